@@ -0,0 +1,201 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.db import connection
+from django.http import Http404, HttpResponse
+from rest_framework import serializers
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Гистограмма Prometheus с метками по имени представления."""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = defaultdict(
+            lambda: {'counts': [0] * (len(buckets) + 1), 'sum': 0})
+        self.lock = threading.Lock()
+
+    def observe(self, view, value):
+        with self.lock:
+            series = self.series[view]
+            series['counts'][bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+
+    def expose(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self.lock:
+            series = {
+                view: (list(data['counts']), data['sum'])
+                for view, data in self.series.items()
+            }
+        for view, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{view="{view}",le="{bound}"}} '
+                    f'{cumulative}')
+            lines.append(f'{self.name}_sum{{view="{view}"}} {total}')
+            lines.append(f'{self.name}_count{{view="{view}"}} {cumulative}')
+        return '\n'.join(lines)
+
+
+REQUEST_DURATION = Histogram(
+    'foodgram_request_duration_seconds',
+    'Время обработки запроса.', LATENCY_BUCKETS)
+DB_QUERIES = Histogram(
+    'foodgram_db_queries', 'Количество SQL-запросов на запрос.',
+    QUERY_BUCKETS)
+DB_DURATION = Histogram(
+    'foodgram_db_duration_seconds', 'Время SQL-запросов на запрос.',
+    LATENCY_BUCKETS)
+SERIALIZE_DURATION = Histogram(
+    'foodgram_serialize_duration_seconds',
+    'Время serializer.data, включая запросы при сериализации.',
+    LATENCY_BUCKETS)
+RENDER_DURATION = Histogram(
+    'foodgram_render_duration_seconds', 'Время рендеринга ответа.',
+    LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram(
+    'foodgram_response_size_bytes', 'Размер тела ответа.', SIZE_BUCKETS)
+HISTOGRAMS = (
+    REQUEST_DURATION, DB_QUERIES, DB_DURATION, SERIALIZE_DURATION,
+    RENDER_DURATION, RESPONSE_SIZE,
+)
+
+
+@contextmanager
+def measure(request, name):
+    """Прибавляет время блока к request.<name>, если метрики собираются.
+
+    Вложенные блоки с тем же name (сериализатор внутри сериализатора)
+    повторно не считаются.
+    """
+    request = getattr(request, '_request', request)
+    running = getattr(request, 'metrics_running', None)
+    if running is None or name in running:
+        yield
+        return
+    running.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        running.discard(name)
+        setattr(request, name,
+                getattr(request, name) + time.perf_counter() - started)
+
+
+class TimedSerializerMixin:
+    """Учитывает serializer.data в метрике сериализации запроса."""
+
+    @property
+    def data(self):
+        with measure(self.context.get('request'), 'serialize_duration'):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class QueryTimer:
+    """Обёртка для connection.execute_wrapper, считающая запросы."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Собирает время ответа, SQL-запросы, сериализацию, рендеринг и
+    размер ответа.
+
+    При выключенном METRICS_ENABLED Django исключает middleware из
+    цепочки, и накладных расходов нет.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.metrics_running = set()
+        request.serialize_duration = 0
+        request.render_duration = 0
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        REQUEST_DURATION.observe(view, duration)
+        DB_QUERIES.observe(view, timer.count)
+        DB_DURATION.observe(view, timer.duration)
+        SERIALIZE_DURATION.observe(view, request.serialize_duration)
+        RENDER_DURATION.observe(view, request.render_duration)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(view, len(response.content))
+
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries"',
+            f'serialize;dur={request.serialize_duration * 1000:.1f}',
+            f'render;dur={request.render_duration * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ))
+        return response
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+
+        def finish_render(response):
+            request.render_duration += time.perf_counter() - started
+
+        response.add_post_render_callback(finish_render)
+        return response
+
+
+def metrics_allowed(request):
+    """Токен сборщика из METRICS_TOKEN или вход администратора."""
+    token = settings.METRICS_TOKEN
+    if token and hmac.compare_digest(
+            request.headers.get('Authorization', '').encode(),
+            f'Bearer {token}'.encode()):
+        return True
+    return request.user.is_staff
+
+
+def metrics_view(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if not metrics_allowed(request):
+        raise PermissionDenied
+    body = '\n'.join(histogram.expose() for histogram in HISTOGRAMS)
+    return HttpResponse(
+        body + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
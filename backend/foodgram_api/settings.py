@@ -25,6 +25,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram_api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -34,6 +35,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
+# Сборщик метрик передаёт токен в заголовке Authorization: Bearer <токен>;
+# без него /api/_metrics открывается только администраторам.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 ROOT_URLCONF = 'foodgram_api.urls'
 
 TEMPLATES = [
@@ -54,6 +60,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram_api.wsgi.application'
 
+ASGI_APPLICATION = 'foodgram_api.asgi.application'
+
 DATABASES = {
     'default': {
         'ENGINE': os.environ.get('DB_ENGINE'),
@@ -65,6 +73,68 @@ DATABASES = {
     }
 }
 
+# Поколения кэша ответов, журнал изменений рецептов и связи
+# пользователей должны быть общими для всех процессов: воркеров WSGI и
+# ASGI и команд manage.py. Без REDIS_URL кэш живёт в памяти процесса и
+# годится только для разработки в одном процессе.
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHE_BACKEND = 'django_redis.cache.RedisCache'
+else:
+    CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': REDIS_URL or 'default',
+    },
+    'pages': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': REDIS_URL or 'pages',
+        'KEY_PREFIX': 'pages',
+        'TIMEOUT': int(os.environ.get('PAGE_CACHE_TIMEOUT', 60)),
+    },
+}
+
+PAGE_CACHE_ALIAS = 'pages'
+
+RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 256,
+    'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 60 * 60)),
+}
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+RECIPE_SEARCH_LIMIT = 1000
+
+USER_RELATIONS_TIMEOUT = 60 * 60
+
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+SHOPPING_LIST_PDF_FONT = os.path.join(
+    BASE_DIR, 'data', 'fonts', 'DejaVuSans.ttf')
+
+FEED_MERGE_THRESHOLD = 1000
+FEED_MERGE_CHUNK_SIZE = 500
+FEED_CACHED_PAGE_SIZE = 50
+FEED_MAX_PAGE_SIZE = 100
+FEED_CACHE_TIMEOUT = 60 * 10
+
+RECIPE_CHANGES_TIMEOUT = 60 * 60 * 24
+
+SIMILAR_INDEX_PATH = os.environ.get(
+    'SIMILAR_INDEX_PATH', os.path.join(BASE_DIR, 'similar_recipes.idx'))
+SIMILAR_RECIPES_LIMIT = 6
+SIMILAR_MAX_LIMIT = 50
+SIMILAR_OVERLAY_LIMIT = 5000
+
+PANTRY_MAX_INGREDIENTS = 100
+PANTRY_RESULTS_LIMIT = 1000
+PANTRY_OVERLAY_LIMIT = 5000
+
+BATCH_MAX_IDS = 100
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -98,6 +168,10 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'backend_static')
 MEDIA_URL = "/backend_media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "backend_media")
 
+RECIPE_IMAGE_MAX_SIZE = 5 * 1024 * 1024
+IMAGE_VARIANTS_ASYNC = True
+IMAGE_VARIANT_WORKERS = 2
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from .models import (CartIngredientTotal, Favorite, Ingredient, Recipe,
+                     ShoppingCart, Tag)
 
 
 class RecipeAdmin(admin.ModelAdmin):
@@ -9,7 +10,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(empty_value=None)
     def followers(self, obj):
-        return obj.favorite_recipe.all().count()
+        return obj.favorites_count
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -21,3 +22,4 @@ admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Favorite)
 admin.site.register(ShoppingCart)
+admin.site.register(CartIngredientTotal)
@@ -0,0 +1,82 @@
+import threading
+from bisect import bisect_left
+
+from .cache import response_cache
+from .models import Ingredient
+
+
+class IngredientIndex:
+    """Отсортированный индекс названий ингредиентов для автодополнения.
+
+    Префиксы ищутся бинарным поиском по отсортированным названиям,
+    вхождения подстроки — по отсортированным суффиксам названий, так что
+    поиск не перебирает все названия. Индекс строится при первом
+    обращении и перестраивается, когда меняется поколение ингредиентов в
+    response_cache, то есть после сигналов post_save/post_delete для
+    Ingredient.
+    """
+
+    namespace = Ingredient._meta.label_lower
+
+    def __init__(self):
+        self._index = ((), (), (), ())
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _ensure_built(self):
+        generation = response_cache.generation(self.namespace)
+        if generation == self._generation:
+            return
+        with self._lock:
+            if generation == self._generation:
+                return
+            rows = sorted(
+                (name.casefold(), id_) for id_, name
+                in Ingredient.objects.values_list('id', 'name').iterator()
+            )
+            keys = tuple(key for key, _ in rows)
+            suffixes = sorted(
+                (key[offset:], position)
+                for position, key in enumerate(keys)
+                for offset in range(1, len(key))
+            )
+            self._index = (
+                keys,
+                tuple(id_ for _, id_ in rows),
+                tuple(suffix for suffix, _ in suffixes),
+                tuple(position for _, position in suffixes),
+            )
+            self._generation = generation
+
+    def reset(self):
+        with self._lock:
+            self._generation = None
+
+    def search(self, query, limit):
+        """Возвращает id ингредиентов: сначала по префиксу в порядке
+        названий, затем по вхождению подстроки в порядке текста от
+        вхождения, не больше limit."""
+        self._ensure_built()
+        keys, ids, suffixes, suffix_keys = self._index
+        query = query.casefold()
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and end - start < limit:
+            if not keys[end].startswith(query):
+                break
+            end += 1
+        result = list(ids[start:end])
+
+        seen = set(range(start, end))
+        position = bisect_left(suffixes, query)
+        while (len(result) < limit and position < len(suffixes)
+               and suffixes[position].startswith(query)):
+            key = suffix_keys[position]
+            if key not in seen:
+                seen.add(key)
+                result.append(ids[key])
+            position += 1
+        return result
+
+
+ingredient_index = IngredientIndex()
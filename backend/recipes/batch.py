@@ -0,0 +1,221 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.response import Response
+from users.models import CustomUser, Follow
+
+from . import cart_totals
+from .counters import change_counters
+from .feed import invalidate_feeds
+from .models import Favorite, Recipe, ShoppingCart
+from .relations import invalidate_relations
+
+
+def parse_ids(request):
+    """Уникальные id из тела {"ids": [...]} или из ?ids=1,2,3.
+
+    None, если список пуст, длиннее BATCH_MAX_IDS или содержит не id.
+    """
+    ids = request.data.get('ids') if hasattr(request.data, 'get') else None
+    if ids is None and 'ids' in request.query_params:
+        ids = [
+            int(id_) if id_.isdigit() else None
+            for id_ in request.query_params['ids'].split(',')
+        ]
+    if (not isinstance(ids, list)
+            or not 0 < len(ids) <= settings.BATCH_MAX_IDS
+            or not all(type(id_) is int and id_ > 0 for id_ in ids)):
+        return None
+    return list(dict.fromkeys(ids))
+
+
+def result(id_, code, message):
+    return {'id': id_, 'status': f'{code}', 'message': message}
+
+
+class RelationBatch:
+    """Массовое добавление и удаление связей пользователя с рецептами
+    или авторами.
+
+    id проверяются одним запросом, изменения идут одним bulk_create
+    или одним DELETE в транзакции, а ответ содержит итог по каждому id.
+    bulk_create не шлёт post_save, поэтому счётчики и кэши для строк,
+    созданных этим вызовом, обновляет after_add; удаление проходит
+    через сигналы post_delete, как и по одному.
+    """
+
+    model = None
+    target_model = None
+    field = None
+    messages = {}
+
+    def __init__(self, user):
+        self.user = user
+
+    def targets(self, ids):
+        return set(self.target_model.objects.filter(
+            pk__in=ids).values_list('pk', flat=True))
+
+    def related(self, ids):
+        return self.model.objects.filter(
+            user=self.user, **{f'{self.field}__in': ids})
+
+    def existing(self, ids):
+        return set(self.related(ids).values_list(
+            f'{self.field}_id', flat=True))
+
+    def rejected(self, id_):
+        """Сообщение, если связь с id_ недопустима."""
+
+    def add(self, ids):
+        found = self.targets(ids)
+        rejected = {id_: self.rejected(id_) for id_ in found}
+        with transaction.atomic():
+            existing = self.existing(found)
+            candidates = [
+                id_ for id_ in ids
+                if id_ in found and id_ not in existing and not rejected[id_]
+            ]
+            added = self.insert(candidates)
+            if added:
+                self.after_add(added)
+        # Пропущенные строки успел вставить параллельный запрос.
+        existing.update(set(candidates) - set(added))
+        results = []
+        for id_ in ids:
+            if id_ not in found:
+                results.append(result(
+                    id_, status.HTTP_404_NOT_FOUND, self.messages['missing']))
+            elif rejected[id_]:
+                results.append(result(
+                    id_, status.HTTP_400_BAD_REQUEST, rejected[id_]))
+            elif id_ in existing:
+                results.append(result(
+                    id_, status.HTTP_400_BAD_REQUEST, self.messages['exists']))
+            else:
+                results.append(result(
+                    id_, status.HTTP_201_CREATED, self.messages['added']))
+        return results
+
+    def insert(self, ids):
+        """Создаёт связи с ids; возвращает id строк, созданных именно
+        этим вызовом.
+
+        Обычно это один INSERT. Если параллельный запрос успел вставить
+        часть строк, вставка повторяется по одной строке в savepoint,
+        чтобы after_add не учёл чужие строки второй раз.
+        """
+        try:
+            with transaction.atomic():
+                self.model.objects.bulk_create(self.rows(ids))
+            return ids
+        except IntegrityError:
+            pass
+        created = []
+        for id_ in ids:
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create(self.rows([id_]))
+            except IntegrityError:
+                continue
+            created.append(id_)
+        return created
+
+    def rows(self, ids):
+        return [
+            self.model(user=self.user, **{f'{self.field}_id': id_})
+            for id_ in ids
+        ]
+
+    def after_add(self, ids):
+        user_id = self.user.pk
+        transaction.on_commit(lambda: invalidate_relations(user_id))
+
+    def remove(self, ids):
+        found = self.targets(ids)
+        with transaction.atomic():
+            related = self.related(found)
+            removed = self.existing(found)
+            related.delete()
+        results = []
+        for id_ in ids:
+            if id_ not in found:
+                results.append(result(
+                    id_, status.HTTP_404_NOT_FOUND, self.messages['missing']))
+            elif id_ not in removed:
+                results.append(result(
+                    id_, status.HTTP_400_BAD_REQUEST, self.messages['absent']))
+            else:
+                results.append(result(
+                    id_, status.HTTP_204_NO_CONTENT, 'Удалено'))
+        return results
+
+
+class FavoriteBatch(RelationBatch):
+    model = Favorite
+    target_model = Recipe
+    field = 'recipe'
+    messages = {
+        'missing': 'Рецепт не найден',
+        'exists': 'Рецепт уже в избранном',
+        'added': 'Добавлено в избранное',
+        'absent': 'Рецепт не был в избранном',
+    }
+
+    def after_add(self, ids):
+        super().after_add(ids)
+        change_counters(Recipe, ids, 'favorites_count', 1)
+
+
+class ShoppingCartBatch(RelationBatch):
+    model = ShoppingCart
+    target_model = Recipe
+    field = 'recipe'
+    messages = {
+        'missing': 'Рецепт не найден',
+        'exists': 'Вы уже добавили рецепт в список покупок',
+        'added': 'Добавлено в список покупок',
+        'absent': 'Рецепт не был в списке покупок',
+    }
+
+    def after_add(self, ids):
+        super().after_add(ids)
+        cart_totals.add_recipes(self.user.pk, ids)
+
+
+class FollowBatch(RelationBatch):
+    model = Follow
+    target_model = CustomUser
+    field = 'author'
+    messages = {
+        'missing': 'Автор не найден',
+        'exists': 'Вы уже подписаны',
+        'added': 'Подписка оформлена',
+        'absent': 'Вы не были подписаны',
+    }
+
+    def rejected(self, id_):
+        if id_ == self.user.pk:
+            return 'Нельзя подписаться на самого себя'
+        return None
+
+    def after_add(self, ids):
+        super().after_add(ids)
+        change_counters(CustomUser, ids, 'followers_count', 1)
+        user_id = self.user.pk
+        transaction.on_commit(lambda: invalidate_feeds([user_id]))
+
+
+def batch_response(request, batch_class):
+    """POST добавляет, DELETE удаляет связи с перечисленными id."""
+    ids = parse_ids(request)
+    if ids is None:
+        return Response({
+            'message': 'Передайте список id в поле ids, '
+                       f'не больше {settings.BATCH_MAX_IDS}',
+            'status': f'{status.HTTP_400_BAD_REQUEST}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    batch = batch_class(request.user)
+    if request.method == 'DELETE':
+        return Response(batch.remove(ids))
+    return Response(batch.add(ids))
@@ -0,0 +1,153 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, urlencode
+from foodgram_api.metrics import measure
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+
+class ResponseCache:
+    """Кэш готовых JSON-ответов: локальный LRU и бэкенд Django.
+
+    Каждое пространство имён (модель) имеет номер поколения, входящий в
+    ключ записи. Инвалидация увеличивает поколение, и старые записи
+    становятся недоступны. Другие процессы видят новое поколение, только
+    если бэкенд общий (Redis, см. REDIS_URL); с кэшем в памяти процесса
+    инвалидация действует лишь в нём, а записи в бэкенде живут не
+    дольше timeout.
+    """
+
+    def __init__(self, max_entries=256, alias=None, timeout=None):
+        self.max_entries = max_entries
+        self.alias = alias
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        if self.alias is None:
+            return None
+        return caches[self.alias]
+
+    @property
+    def process_local(self):
+        """True, если поколения не видны другим процессам."""
+        return self.shared is None or isinstance(self.shared, LocMemCache)
+
+    def _generation_key(self, namespace):
+        return f'response-cache:{namespace}:generation'
+
+    def generation(self, namespace):
+        if self.shared is None:
+            return self._generations.get(namespace, 0)
+        return self.shared.get_or_set(
+            self._generation_key(namespace), 0, None)
+
+    def make_key(self, namespace, key):
+        generation = self.generation(namespace)
+        digest = hashlib.md5(key.encode()).hexdigest()
+        return f'response-cache:{namespace}:{generation}:{digest}'
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if self.shared is None:
+            return None
+        entry = self.shared.get(key)
+        if entry is not None:
+            self._set_local(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        self._set_local(key, entry)
+        if self.shared is not None:
+            self.shared.set(key, entry, self.timeout)
+
+    def _set_local(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, namespace):
+        prefix = f'response-cache:{namespace}:'
+        with self._lock:
+            self._generations[namespace] = (
+                self._generations.get(namespace, 0) + 1)
+            for key in [key for key in self._entries
+                        if key.startswith(prefix)]:
+                del self._entries[key]
+        if self.shared is not None:
+            generation_key = self._generation_key(namespace)
+            try:
+                self.shared.incr(generation_key)
+            except ValueError:
+                self.shared.set(generation_key, 1, None)
+
+
+response_cache = ResponseCache(**{
+    key.lower(): value
+    for key, value in getattr(settings, 'RESPONSE_CACHE', {}).items()
+})
+
+
+class CachedResponseMixin:
+    """Отдаёт list и retrieve из response_cache с поддержкой ETag."""
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        key = response_key(
+            self.queryset.model._meta.label_lower, request.path,
+            request.query_params)
+        entry = response_cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            with measure(request, 'render_duration'):
+                entry = make_entry(response.data)
+            response_cache.set(key, entry)
+        return entry_response(request, entry)
+
+
+def response_key(namespace, path, params):
+    query = urlencode(sorted(params.lists()), doseq=True)
+    return response_cache.make_key(namespace, f'{path}?{query}')
+
+
+def make_entry(data):
+    """Запись кэша: ETag и готовое JSON-тело ответа."""
+    return body_entry(JSONRenderer().render(data))
+
+
+def body_entry(body):
+    return f'"{hashlib.md5(body).hexdigest()}"', body
+
+
+def entry_response(request, entry):
+    etag, body = entry
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
@@ -0,0 +1,115 @@
+from collections import defaultdict
+
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+
+from .models import CartIngredientTotal, IngredientForRecipe, ShoppingCart
+
+
+def recipe_amounts(recipe_id):
+    return dict(IngredientForRecipe.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', 'amount'))
+
+
+def apply_deltas(user_ids, deltas):
+    """Прибавляет {id ингредиента: изменение} к итогам пользователей.
+
+    Недостающие строки создаются с нулём, обнулившиеся удаляются.
+    Обновлений столько, сколько различных значений изменения.
+    """
+    user_ids = list(user_ids)
+    deltas = {id_: delta for id_, delta in deltas.items() if delta}
+    if not user_ids or not deltas:
+        return
+    added = [id_ for id_, delta in deltas.items() if delta > 0]
+    CartIngredientTotal.objects.bulk_create([
+        CartIngredientTotal(user_id=user_id, ingredient_id=id_)
+        for user_id in user_ids for id_ in added
+    ], ignore_conflicts=True)
+
+    by_delta = defaultdict(list)
+    for id_, delta in deltas.items():
+        by_delta[delta].append(id_)
+    totals = CartIngredientTotal.objects.filter(user_id__in=user_ids)
+    for delta, ids in by_delta.items():
+        totals.filter(ingredient_id__in=ids).update(
+            amount=Greatest(F('amount') + delta, 0))
+    if len(added) < len(deltas):
+        totals.filter(ingredient_id__in=list(deltas), amount=0).delete()
+
+
+def add_recipe(user_id, recipe_id):
+    apply_deltas([user_id], recipe_amounts(recipe_id))
+
+
+def add_recipes(user_id, recipe_ids):
+    """Добавляет в итоги пользователя сразу несколько рецептов."""
+    apply_deltas([user_id], dict(IngredientForRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by().values('ingredient_id').annotate(
+        total=Sum('amount')
+    ).values_list('ingredient_id', 'total')))
+
+
+def remove_recipe(user_id, recipe_id):
+    apply_deltas([user_id], {
+        id_: -amount for id_, amount in recipe_amounts(recipe_id).items()
+    })
+
+
+def change_recipe(recipe_id, deltas):
+    """Переносит изменение состава рецепта в корзины, где он лежит."""
+    apply_deltas(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id).values_list('user_id', flat=True),
+        deltas,
+    )
+
+
+def live_totals(user_ids=None):
+    """Итоги, посчитанные заново по корзинам и составу рецептов."""
+    carts = ShoppingCart.objects.all()
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+    return carts.filter(
+        recipe__ingredientforrecipe__isnull=False
+    ).values(
+        'user_id',
+        ingredient_id=F('recipe__ingredientforrecipe__ingredient_id'),
+    ).annotate(
+        amount=Sum('recipe__ingredientforrecipe__amount')
+    ).order_by()
+
+
+def find_mismatches():
+    """{(пользователь, ингредиент): (сохранено, на самом деле)}."""
+    live = {
+        (row['user_id'], row['ingredient_id']): row['amount']
+        for row in live_totals().iterator()
+    }
+    stored = {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount
+        in CartIngredientTotal.objects.filter(amount__gt=0).values_list(
+            'user_id', 'ingredient_id', 'amount').iterator()
+    }
+    return {
+        key: (stored.get(key, 0), live.get(key, 0))
+        for key in live.keys() | stored.keys()
+        if stored.get(key, 0) != live.get(key, 0)
+    }
+
+
+def rebuild(user_ids=None, batch_size=2000):
+    """Пересобирает итоги пользователей (или всех) из корзин."""
+    totals = CartIngredientTotal.objects.all()
+    if user_ids is not None:
+        totals = totals.filter(user_id__in=user_ids)
+    totals.delete()
+    CartIngredientTotal.objects.bulk_create((
+        CartIngredientTotal(
+            user_id=row['user_id'],
+            ingredient_id=row['ingredient_id'],
+            amount=row['amount'],
+        ) for row in live_totals(user_ids).iterator()
+    ), batch_size=batch_size)
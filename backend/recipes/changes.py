@@ -0,0 +1,57 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = 'recipe-changes:version'
+LOG_KEY = 'recipe-changes:log'
+
+
+def change_key(version):
+    return f'recipe-changes:{version}'
+
+
+def log_version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def log_id():
+    """Метка журнала: другая у журнала в памяти другого процесса и
+    после сброса кэша, когда версии уже нельзя сравнивать."""
+    log = cache.get(LOG_KEY)
+    if log is None:
+        cache.add(LOG_KEY, uuid.uuid4().hex, None)
+        return cache.get(LOG_KEY)
+    return log
+
+
+def record_change(recipe_id):
+    """Записывает рецепт с изменённым составом в журнал для индексов
+    в памяти других процессов."""
+    if cache.add(VERSION_KEY, 1, None):
+        version = 1
+    else:
+        version = cache.incr(VERSION_KEY)
+    cache.set(
+        change_key(version), recipe_id, settings.RECIPE_CHANGES_TIMEOUT)
+
+
+def reset_changes():
+    """Пропускает версию журнала после записи в обход сигналов: индексы
+    не найдут её в журнале и перестроятся по базе."""
+    if not cache.add(VERSION_KEY, 1, None):
+        cache.incr(VERSION_KEY)
+
+
+def changed_since(version, current):
+    """id рецептов, изменённых после version по current включительно.
+
+    None, если журнал не покрывает этот отрезок (истёк или сброшен).
+    """
+    if current < version:
+        return None
+    keys = [change_key(number) for number in range(version + 1, current + 1)]
+    changes = cache.get_many(keys) if keys else {}
+    if len(changes) < len(keys):
+        return None
+    return set(changes.values())
@@ -0,0 +1,95 @@
+import heapq
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from users.models import Follow
+
+from .models import Recipe
+
+ORDERING = ('-pub_date', '-id')
+
+
+def encode_cursor(position):
+    pub_date, pk = position
+    return urlsafe_b64encode(
+        f'{pub_date.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_cursor(value):
+    """(pub_date, id) последнего показанного рецепта или None.
+
+    Для повреждённого курсора выбрасывает ValueError.
+    """
+    if not value:
+        return None
+    pub_date, pk = urlsafe_b64decode(value.encode()).decode().split('|')
+    return datetime.fromisoformat(pub_date), int(pk)
+
+
+def after(queryset, position):
+    """Рецепты строго после position в порядке ORDERING."""
+    if position is None:
+        return queryset
+    pub_date, pk = position
+    return queryset.filter(
+        Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk))
+
+
+def positions(queryset, position, size):
+    return after(queryset, position).order_by(*ORDERING).values_list(
+        'pub_date', 'id')[:size]
+
+
+def merged_positions(author_ids, position, size):
+    """k-путевое слияние потоков рецептов по группам авторов.
+
+    Каждая группа — один запрос по индексу (author, -pub_date) с
+    LIMIT size; heapq.merge берёт из потоков первые size позиций.
+    """
+    author_ids = sorted(author_ids)
+    chunk_size = settings.FEED_MERGE_CHUNK_SIZE
+    streams = [
+        positions(
+            Recipe.objects.filter(
+                author__in=author_ids[start:start + chunk_size]),
+            position, size,
+        )
+        for start in range(0, len(author_ids), chunk_size)
+    ]
+    return list(islice(heapq.merge(*streams, reverse=True), size))
+
+
+def feed_positions(user, following, position, size):
+    """(pub_date, id) следующих size рецептов авторов из подписок."""
+    if len(following) > settings.FEED_MERGE_THRESHOLD:
+        return merged_positions(following, position, size)
+    return list(positions(
+        Recipe.objects.filter(author__in=Follow.objects.filter(
+            user=user).values('author_id')),
+        position, size,
+    ))
+
+
+def feed_key(user_id):
+    return f'recipe-feed:{user_id}'
+
+
+def feed_page(user, following, position, size):
+    """Позиции страницы ленты; первая страница берётся из кэша."""
+    cached_size = settings.FEED_CACHED_PAGE_SIZE + 1
+    if position is not None or size > cached_size:
+        return feed_positions(user, following, position, size)
+    key = feed_key(user.pk)
+    first_page = cache.get(key)
+    if first_page is None:
+        first_page = feed_positions(user, following, None, cached_size)
+        cache.set(key, first_page, settings.FEED_CACHE_TIMEOUT)
+    return first_page[:size]
+
+
+def invalidate_feeds(user_ids):
+    cache.delete_many([feed_key(user_id) for user_id in user_ids])
@@ -0,0 +1,53 @@
+import hashlib
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+
+from .images import variant_urls
+
+
+class RecipeImageField(Base64ImageField):
+    """Base64-изображение с ограничением размера и именем по хэшу.
+
+    Одинаковые картинки получают одно имя файла; уже сохранённый файл
+    повторно не записывается.
+    """
+
+    default_error_messages = {
+        'too_large': 'Размер изображения не должен превышать {max_size} байт.',
+    }
+
+    def to_internal_value(self, base64_data):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if (isinstance(base64_data, str)
+                and len(base64_data) * 3 // 4 > max_size):
+            self.fail('too_large', max_size=max_size)
+        image = super().to_internal_value(base64_data)
+        if image is not None and default_storage.exists(image.name):
+            return image.name
+        return image
+
+    def get_file_name(self, decoded_file):
+        return hashlib.sha256(decoded_file).hexdigest()[:32]
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные копии изображения рецепта."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        request = self.context.get('request')
+        urls = variant_urls(recipe)
+        if request is None:
+            return urls
+        return {
+            variant: request.build_absolute_uri(url)
+            for variant, url in urls.items()
+        }
@@ -1,34 +1,91 @@
 import django_filters as filters
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Exists, IntegerField, OuterRef, When
+from django_filters.widgets import BooleanWidget
 
-from .models import Ingredient, Recipe
+from .autocomplete import ingredient_index
+from .cache import response_cache
+from .models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from .search import search_recipes, with_ingredients
 
 
 class IngredientFilter(filters.FilterSet):
-    name = filters.CharFilter(field_name='name', lookup_expr='istartswith')
+    name = filters.CharFilter(method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ('name', )
 
+    def filter_name(self, queryset, name, value):
+        ids = ingredient_index.search(value, settings.INGREDIENT_SEARCH_LIMIT)
+        ranking = Case(
+            *[When(pk=pk, then=position) for position, pk in enumerate(ids)],
+            output_field=IntegerField(),
+        )
+        return queryset.filter(pk__in=ids).order_by(ranking)
+
+
+def tag_choices():
+    """Slug тегов из кэша; ключ меняется при изменении тегов."""
+    generation = response_cache.generation(Tag._meta.label_lower)
+    return cache.get_or_set(
+        f'recipe-filter:tag-choices:{generation}',
+        lambda: list(Tag.objects.values_list('slug', 'slug')),
+        None,
+    )
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
-    is_favorited = filters.BooleanFilter(method='get_is_favorited')
+    search = filters.CharFilter(method='get_search')
+    ingredients = NumberInFilter(method='get_ingredients')
+    tags = filters.MultipleChoiceFilter(
+        field_name='tags__slug', choices=tag_choices, method='get_tags')
+    author = filters.NumberFilter(field_name='author')
+    is_favorited = filters.BooleanFilter(
+        method='get_is_favorited', widget=BooleanWidget())
     is_in_shopping_cart = filters.BooleanFilter(
-        method='get_is_in_shopping_cart')
+        method='get_is_in_shopping_cart', widget=BooleanWidget())
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'search', 'ingredients', 'tags', 'author',
+            'is_favorited', 'is_in_shopping_cart',
+        )
 
-    def get_is_favorited(self, queryset, name, value):
+    def get_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(
+            queryset, value, settings.RECIPE_SEARCH_LIMIT)
+
+    def get_ingredients(self, queryset, name, value):
+        if not value:
+            return queryset
+        return with_ingredients(queryset, value)
+
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__slug__in=value)))
+
+    def filter_by_user(self, queryset, model, value):
+        if not value:
+            return queryset
         user = self.request.user
-        if value:
-            return Recipe.objects.filter(favorite_recipe__user=user)
-        return Recipe.objects.all()
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            user=user, recipe=OuterRef('pk'))))
+
+    def get_is_favorited(self, queryset, name, value):
+        return self.filter_by_user(queryset, Favorite, value)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        if value:
-            return Recipe.objects.filter(customers__user=user)
-        return Recipe.objects.all()
+        return self.filter_by_user(queryset, ShoppingCart, value)
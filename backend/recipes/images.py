@@ -0,0 +1,99 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, features
+
+from .cache import response_cache
+from .models import Recipe
+from .page_cache import invalidate_recipe_pages, recipe_tag_slugs
+
+VARIANTS = {
+    'thumbnail': (320, 320),
+    'medium': (960, 960),
+}
+VARIANTS_DIR = 'variants'
+
+if features.check('webp'):
+    VARIANT_FORMAT, VARIANT_EXTENSION = 'WEBP', 'webp'
+else:
+    VARIANT_FORMAT, VARIANT_EXTENSION = 'JPEG', 'jpg'
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_VARIANT_WORKERS,
+    thread_name_prefix='image-variants',
+)
+
+
+def variant_name(name, variant):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f'{VARIANTS_DIR}/{stem}_{variant}.{VARIANT_EXTENSION}'
+
+
+def generate_variants(name):
+    """Создаёт уменьшенные копии изображения, если их ещё нет, и
+    отмечает у рецептов с этим изображением, что копии готовы."""
+    missing = {
+        variant: size for variant, size in VARIANTS.items()
+        if not default_storage.exists(variant_name(name, variant))
+    }
+    if missing:
+        with default_storage.open(name) as file:
+            original = Image.open(file)
+            original.load()
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA')
+        if VARIANT_FORMAT == 'JPEG':
+            original = original.convert('RGB')
+
+        for variant, size in missing.items():
+            image = original.copy()
+            image.thumbnail(size)
+            buffer = io.BytesIO()
+            image.save(buffer, VARIANT_FORMAT, quality=85)
+            default_storage.save(
+                variant_name(name, variant), ContentFile(buffer.getvalue()))
+
+    recipes = list(Recipe.objects.filter(image=name).exclude(
+        image_variants_name=name).values_list('pk', 'author_id'))
+    if not recipes:
+        return
+    Recipe.objects.filter(
+        pk__in=[pk for pk, _ in recipes]).update(image_variants_name=name)
+    # update() не шлёт сигналов: кэши ответов сбрасываются здесь.
+    response_cache.invalidate(Recipe._meta.label_lower)
+    for pk, author_id in recipes:
+        invalidate_recipe_pages(pk, author_id, recipe_tag_slugs(pk))
+
+
+def generate_variants_in_thread(name):
+    try:
+        generate_variants(name)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(name):
+    """Запускает генерацию копий после коммита транзакции."""
+    if settings.IMAGE_VARIANTS_ASYNC:
+        transaction.on_commit(
+            lambda: executor.submit(generate_variants_in_thread, name))
+    else:
+        transaction.on_commit(lambda: generate_variants(name))
+
+
+def variant_urls(recipe):
+    """Ссылки на копии изображения рецепта; до их создания отдаётся
+    оригинал. Готовность копий записана в рецепте при загрузке, так что
+    хранилище здесь не опрашивается."""
+    image = recipe.image
+    if recipe.image_variants_name != image.name:
+        return {variant: image.url for variant in VARIANTS}
+    return {
+        variant: default_storage.url(variant_name(image.name, variant))
+        for variant in VARIANTS
+    }
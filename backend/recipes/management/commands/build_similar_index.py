@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from recipes.cache import response_cache
+from recipes.similar import SimilarityMatrix
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит матрицу TF-IDF векторов рецептов по ингредиентам для '
+        '/api/recipes/{id}/similar/ и сохраняет её в SIMILAR_INDEX_PATH. '
+        'Воркеры открывают новый файл через mmap при следующем запросе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=settings.SIMILAR_INDEX_PATH,
+            help='Файл матрицы.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        matrix = SimilarityMatrix.from_database()
+        matrix.save(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов: {len(matrix)}, ингредиентов: '
+            f'{len(matrix.ingredient_ids)}, ненулевых весов: '
+            f'{len(matrix.row_vals)} за '
+            f'{time.perf_counter() - started:.1f} с -> {options["output"]}'))
+        if response_cache.process_local:
+            self.stdout.write(self.style.WARNING(
+                'Кэш не общий (REDIS_URL не задан): сервер не сможет '
+                'сверить журнал изменений и построит матрицу по базе сам.'
+            ))
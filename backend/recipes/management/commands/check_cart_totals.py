@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.cart_totals import find_mismatches, rebuild
+
+SAMPLE_SIZE = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет материализованные итоги списков покупок с агрегатом '
+        'по корзинам и при --fix пересобирает расходящиеся.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Пересобрать итоги пользователей с расхождениями.',
+        )
+
+    def handle(self, *args, **options):
+        mismatches = find_mismatches()
+        for (user_id, ingredient_id), (stored, actual) in sorted(
+                mismatches.items())[:SAMPLE_SIZE]:
+            self.stdout.write(
+                f'пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'сохранено {stored}, по корзине {actual}')
+        self.stdout.write(f'Расхождений: {len(mismatches)}')
+        if not mismatches:
+            return
+        if not options['fix']:
+            raise CommandError('Итоги списков покупок не совпадают.')
+        user_ids = {user_id for user_id, _ in mismatches}
+        rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобраны итоги пользователей: {len(user_ids)}'))
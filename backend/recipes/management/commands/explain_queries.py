@@ -0,0 +1,72 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from recipes.models import Recipe, Tag
+from recipes.shopping_list import shopping_list_queryset
+from users.models import CustomUser
+
+
+def timings(queryset, repeat):
+    """Время выполнения запроса в миллисекундах, repeat раз подряд."""
+    result = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        list(queryset.all())
+        result.append((time.perf_counter() - started) * 1000)
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет время горячих запросов ленты рецептов и списка покупок '
+        'и выводит их планы выполнения. Запустите на заполненной базе до '
+        'и после изменения индексов, чтобы сравнить время и планы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Сколько раз выполнить каждый запрос (по умолчанию 5).',
+        )
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Показать план с фактическим временем и чтениями буферов '
+                 '(EXPLAIN ANALYZE, только PostgreSQL).',
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть не меньше 1.')
+        if options['analyze'] and connection.vendor != 'postgresql':
+            raise CommandError('EXPLAIN ANALYZE доступен только в PostgreSQL.')
+        user = CustomUser.objects.order_by('?').first()
+        tag = Tag.objects.order_by('?').first()
+        if user is None or tag is None:
+            self.stderr.write('Нужны хотя бы один пользователь и один тег.')
+            return
+
+        recipes = Recipe.objects.order_by('-pub_date')
+        queries = {
+            'recipes by tag': recipes.filter(tags__slug=tag.slug)[:6],
+            'recipes by author': recipes.filter(author=user)[:6],
+            'favorited recipes': recipes.filter(
+                favorite_recipe__user=user)[:6],
+            'recipes in shopping cart': recipes.filter(
+                customers__user=user)[:6],
+            'shopping list': shopping_list_queryset(user),
+        }
+
+        explain_options = (
+            {'analyze': True, 'buffers': True} if options['analyze'] else {})
+        for title, queryset in queries.items():
+            # Первый прогон прогревает кэш страниц базы и не учитывается.
+            measured = timings(queryset, options['repeat'] + 1)[1:]
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(
+                f'медиана {statistics.median(measured):.2f} мс, '
+                f'мин {min(measured):.2f} мс, '
+                f'макс {max(measured):.2f} мс')
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
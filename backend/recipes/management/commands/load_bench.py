@@ -0,0 +1,112 @@
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import Ingredient, Recipe, Tag
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочное сравнение WSGI- и ASGI-серверов на анонимных '
+        'запросах к рецептам, тегам и ингредиентам. Серверы должны быть '
+        'запущены с одинаковым числом воркеров и общей базой.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--wsgi-url', default='http://127.0.0.1:8000',
+            help='Адрес WSGI-сервера (gunicorn foodgram_api.wsgi).',
+        )
+        parser.add_argument(
+            '--asgi-url', default='http://127.0.0.1:8001',
+            help='Адрес ASGI-сервера (uvicorn foodgram_api.asgi).',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=64,
+            help='Число одновременных клиентов.',
+        )
+        parser.add_argument(
+            '--requests', type=int, default=2000,
+            help='Число запросов к каждому серверу.',
+        )
+        parser.add_argument(
+            '--output', default='load_bench.json',
+            help='Файл для результатов в формате JSON.',
+        )
+
+    def handle(self, *args, **options):
+        paths = self.paths()
+        results = {}
+        for name in ('wsgi', 'asgi'):
+            base_url = options[f'{name}_url'].rstrip('/')
+            results[name] = self.load(
+                [base_url + path for path in paths],
+                options['concurrency'], options['requests'])
+            self.report(name, results[name])
+
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump({
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+                'paths': paths,
+                'results': results,
+            }, file, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+    def paths(self):
+        recipe = Recipe.objects.values_list('id', flat=True).first()
+        tag = Tag.objects.values_list('id', flat=True).first()
+        ingredient = Ingredient.objects.values_list('id', flat=True).first()
+        if None in (recipe, tag, ingredient):
+            raise CommandError('База пуста: сначала выполните seed_bench.')
+        return [
+            '/api/recipes/?limit=6',
+            '/api/recipes/?limit=6&page=2',
+            '/api/recipes/?limit=24',
+            f'/api/recipes/{recipe}/',
+            '/api/tags/',
+            f'/api/tags/{tag}/',
+            '/api/ingredients/?name=са',
+            f'/api/ingredients/{ingredient}/',
+        ]
+
+    def load(self, targets, concurrency, total):
+        local = threading.local()
+
+        def fetch(url):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            started = time.perf_counter()
+            try:
+                ok = local.session.get(url, timeout=30).status_code < 400
+            except requests.RequestException:
+                ok = False
+            return (time.perf_counter() - started) * 1000, ok
+
+        urls = [targets[number % len(targets)] for number in range(total)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            responses = list(pool.map(fetch, urls))
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(timing for timing, _ in responses)
+        return {
+            'rps': round(total / elapsed, 1),
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+            'p99_ms': round(timings[int(len(timings) * 0.99) - 1], 3),
+            'max_ms': round(timings[-1], 3),
+            'errors': sum(1 for _, ok in responses if not ok),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name}: {result["rps"]:8.1f} rps  '
+            f'median {result["median_ms"]:9.3f} ms  '
+            f'p95 {result["p95_ms"]:9.3f} ms  '
+            f'p99 {result["p99_ms"]:9.3f} ms  '
+            f'errors {result["errors"]}')
@@ -0,0 +1,119 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.cache import response_cache
+from recipes.models import Ingredient
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) != 2:
+            continue
+        yield row[0].strip(), row[1].strip()
+
+
+def read_json(file):
+    for item in json.load(file):
+        yield item['name'].strip(), item['measurement_unit'].strip()
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV (название,единица) или JSON '
+        'пакетами через bulk_create. Повторный запуск не создаёт дублей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+            help='Путь к файлу .csv или .json.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество строк в одном INSERT.',
+        )
+        parser.add_argument(
+            '--update', action='store_true',
+            help='Обновить единицы измерения уже существующих ингредиентов.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        batch_size = options['batch_size']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json.')
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+
+        started = time.perf_counter()
+        existing = dict(
+            Ingredient.objects.values_list('name', 'measurement_unit'))
+        before = len(existing)
+        processed = 0
+        updated = 0
+
+        with open(path, encoding='utf-8') as file, transaction.atomic():
+            rows = reader(file)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                processed += len(batch)
+                to_create = {}
+                to_update = {}
+                for name, unit in batch:
+                    if name not in existing:
+                        to_create[name] = unit
+                    elif options['update'] and existing[name] != unit:
+                        to_update[name] = unit
+                    existing.setdefault(name, unit)
+
+                Ingredient.objects.bulk_create(
+                    [Ingredient(name=name, measurement_unit=unit)
+                     for name, unit in to_create.items()],
+                    ignore_conflicts=True,
+                )
+                if to_update:
+                    updated += self.update_units(to_update, batch_size)
+                    existing.update(to_update)
+                self.stdout.write(f'Обработано строк: {processed}')
+
+        # bulk_create не шлёт сигналов: поколение ингредиентов меняется
+        # здесь, и по нему работающий сервер сбросит кэш ответов и
+        # перестроит индекс автодополнения.
+        response_cache.invalidate(Ingredient._meta.label_lower)
+
+        elapsed = time.perf_counter() - started
+        created = Ingredient.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: создано {created}, обновлено {updated}, '
+            f'строк {processed} за {elapsed:.3f} с '
+            f'({processed / elapsed:.0f} строк/с).'
+        ))
+        if response_cache.process_local:
+            self.stdout.write(self.style.WARNING(
+                'Кэш не общий (REDIS_URL не задан): перезапустите сервер, '
+                'чтобы он увидел новые ингредиенты.'
+            ))
+
+    def update_units(self, units, batch_size):
+        ingredients = list(Ingredient.objects.filter(name__in=list(units)))
+        for ingredient in ingredients:
+            ingredient.measurement_unit = units[ingredient.name]
+        Ingredient.objects.bulk_update(
+            ingredients, ['measurement_unit'], batch_size=batch_size)
+        return len(ingredients)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from recipes.counters import COUNTERS, recount
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает денормализованные счётчики избранного, рецептов '
+        'и подписчиков и исправляет расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только показать расхождения, ничего не изменяя.',
+        )
+
+    def handle(self, *args, **options):
+        fix = not options['check']
+        for model, field, related_model, related_field in COUNTERS:
+            drifted = recount(model, field, related_model, related_field, fix)
+            self.stdout.write(
+                f'{model._meta.label}.{field}: расхождений {drifted}')
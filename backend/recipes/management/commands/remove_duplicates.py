@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Min, Sum
+from recipes.cache import response_cache
+from recipes.changes import reset_changes
+from recipes.models import (INGREDIENT_AMOUNT_MAX, IngredientForRecipe, Recipe,
+                            ShoppingCart, Tag)
+
+CHUNK_SIZE = 500
+
+
+def first_ids(model, fields):
+    """Id первой строки в каждой группе с одинаковыми fields."""
+    return model.objects.order_by().values(*fields).annotate(
+        first_id=Min('id')).values('first_id')
+
+
+def duplicate_ids(model, fields):
+    return list(model.objects.exclude(
+        pk__in=first_ids(model, fields)).values_list('pk', flat=True))
+
+
+def delete_rows(model, ids):
+    """Удаляет строки без сигналов: обработчики пишут в таблицы, которых
+    до migrate может ещё не быть."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[start:start + CHUNK_SIZE]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {column} IN ({placeholders})',
+                chunk)
+
+
+def dedupe_shopping_cart(fix):
+    ids = duplicate_ids(ShoppingCart, ['user', 'recipe'])
+    if fix:
+        delete_rows(ShoppingCart, ids)
+    return len(ids)
+
+
+def dedupe_recipe_ingredients(fix):
+    """Оставляет первую строку ингредиента в рецепте с суммой количеств."""
+    ids = duplicate_ids(IngredientForRecipe, ['recipe', 'ingredient'])
+    if fix and ids:
+        groups = IngredientForRecipe.objects.order_by().values(
+            'recipe', 'ingredient'
+        ).annotate(
+            rows=Count('id'), first_id=Min('id'), total=Sum('amount'),
+        ).filter(rows__gt=1)
+        for group in groups:
+            IngredientForRecipe.objects.filter(pk=group['first_id']).update(
+                amount=min(group['total'], INGREDIENT_AMOUNT_MAX))
+        delete_rows(IngredientForRecipe, ids)
+    return len(ids)
+
+
+def dedupe_tag_slugs(fix):
+    """Повторным slug тегов дописывает id тега."""
+    ids = duplicate_ids(Tag, ['slug'])
+    if fix:
+        for pk, slug in Tag.objects.filter(pk__in=ids).values_list(
+                'pk', 'slug'):
+            suffix = f'-{pk}'
+            Tag.objects.filter(pk=pk).update(
+                slug=slug[:Tag._meta.get_field('slug').max_length
+                          - len(suffix)] + suffix)
+    return len(ids)
+
+
+class Command(BaseCommand):
+    help = (
+        'Убирает дубли, из-за которых migrate не может добавить '
+        'уникальные ограничения: повторные рецепты в корзине, повторные '
+        'ингредиенты рецепта (количества складываются) и повторные slug '
+        'тегов. Запускайте перед migrate.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только показать число дублей, ничего не изменяя.',
+        )
+
+    def handle(self, *args, **options):
+        fix = not options['check']
+        steps = (
+            (ShoppingCart, dedupe_shopping_cart),
+            (IngredientForRecipe, dedupe_recipe_ingredients),
+            (Tag, dedupe_tag_slugs),
+        )
+        found = 0
+        with transaction.atomic():
+            for model, dedupe in steps:
+                count = dedupe(fix)
+                found += count
+                self.stdout.write(f'{model._meta.label}: дублей {count}')
+        if fix and found:
+            for model in (Tag, Recipe):
+                response_cache.invalidate(model._meta.label_lower)
+            reset_changes()
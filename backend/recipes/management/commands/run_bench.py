@@ -0,0 +1,221 @@
+import json
+import random
+import statistics
+import time
+from itertools import cycle
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from recipes.autocomplete import ingredient_index
+from recipes.models import IngredientForRecipe, Recipe, Tag
+from recipes.pantry import PantryIndex
+from recipes.similar import SimilarityMatrix, nearest
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import CustomUser
+
+SEARCH_QUERIES = ('с', 'са', 'сах', 'мол', 'мука', 'яйц', 'сок', 'перец')
+SYNTHETIC_RECIPES = 100000
+SYNTHETIC_INGREDIENTS = 2000
+SYNTHETIC_PER_RECIPE = 10
+
+
+def percentile(values, percent):
+    """Перцентиль с линейной интерполяцией между соседними значениями."""
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет задержку и число SQL-запросов основных эндпоинтов на '
+        'текущей базе (см. seed_bench) и сохраняет результат в JSON. '
+        'С --compare завершается ошибкой при регрессии.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', default='bench.json')
+        parser.add_argument(
+            '--compare', default=None,
+            help='JSON предыдущего запуска для сравнения.',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=1.25,
+            help='Допустимое отношение медианы к базовой.',
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом.',
+        )
+
+    def handle(self, *args, **options):
+        user = CustomUser.objects.annotate(
+            cart=Count('purchases')).order_by('-cart').first()
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True)[:1000])
+        if user is None or not recipe_ids:
+            raise CommandError('База пуста: сначала выполните seed_bench.')
+
+        anonymous = APIClient()
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        recipes = cycle(random.Random(0).sample(recipe_ids, len(recipe_ids)))
+        searches = cycle(SEARCH_QUERIES)
+        tag_query = '&'.join(
+            f'tags={slug}' for slug in Tag.objects.annotate(
+                recipes_total=Count('recipes')
+            ).order_by('-recipes_total').values_list('slug', flat=True)[:2]
+        )
+        ingredient_ids = ','.join(
+            str(pk) for pk in IngredientForRecipe.objects.filter(
+                recipe_id=recipe_ids[0]
+            ).values_list('ingredient_id', flat=True)[:2]
+        )
+
+        scenarios = {
+            'recipe_list_anonymous': lambda: anonymous.get(
+                '/api/recipes/?limit=6'),
+            'recipe_list': lambda: client.get('/api/recipes/?limit=6'),
+            'recipe_list_limit_100': lambda: client.get(
+                '/api/recipes/?limit=100'),
+            'recipe_list_cursor': lambda: client.get(
+                '/api/recipes/?pagination=cursor&limit=6'),
+            'recipe_detail': lambda: client.get(
+                f'/api/recipes/{next(recipes)}/'),
+            'filter_tags': lambda: client.get(
+                f'/api/recipes/?limit=6&{tag_query}'),
+            'filter_author': lambda: client.get(
+                f'/api/recipes/?limit=6&author={user.pk}'),
+            'filter_is_favorited': lambda: client.get(
+                '/api/recipes/?limit=6&is_favorited=1'),
+            'filter_is_in_shopping_cart': lambda: client.get(
+                '/api/recipes/?limit=6&is_in_shopping_cart=1'),
+            'recipe_search': lambda: client.get(
+                '/api/recipes/?limit=6&search=рецепт'),
+            'filter_ingredients': lambda: client.get(
+                f'/api/recipes/?limit=6&ingredients={ingredient_ids}'),
+            'feed': lambda: client.get('/api/recipes/feed/?limit=6'),
+            'subscriptions': lambda: client.get(
+                '/api/users/subscriptions/?recipes_limit=3'),
+            'ingredient_search': lambda: anonymous.get(
+                f'/api/ingredients/?name={next(searches)}'),
+            'shopping_list_txt': lambda: client.get(
+                '/api/recipes/download_shopping_cart/'),
+            'shopping_list_pdf': lambda: client.get(
+                '/api/recipes/download_shopping_cart/?format=pdf'),
+        }
+
+        results = {}
+        for name, request in scenarios.items():
+            results[name] = self.measure(
+                request, options['repeat'], options['cold'])
+            self.report(name, results[name])
+
+        for name, function in self.functions().items():
+            results[name] = self.measure(function, options['repeat'], False)
+            self.report(name, results[name])
+
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump({
+                'database': connection.vendor,
+                'recipes': Recipe.objects.count(),
+                'repeat': options['repeat'],
+                'cold': options['cold'],
+                'results': results,
+            }, file, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    def functions(self):
+        searches = cycle(SEARCH_QUERIES)
+        matrix = SimilarityMatrix.build(self.synthetic_recipes())
+        pantry = PantryIndex(self.synthetic_recipes())
+        pantries = cycle([
+            random.Random(number).sample(range(1, 201), 15)
+            for number in range(100)
+        ])
+        matrix_rows = cycle(
+            random.Random(0).sample(range(len(matrix)), 1000))
+
+        def similar_top_k():
+            row = next(matrix_rows)
+            return nearest(
+                matrix, matrix.recipe_ids[row], matrix.vector(row), 10)
+
+        return {
+            'ingredient_index_search': lambda: ingredient_index.search(
+                next(searches), 50),
+            'similar_top_k_100k_recipes': similar_top_k,
+            'pantry_match_100k_recipes': lambda: pantry.match(
+                next(pantries), 1000),
+        }
+
+    def synthetic_recipes(self):
+        """Пары (рецепт, ингредиент) с популярностью ингредиентов по
+        Ципфу, как у соли и сахара против редких специй."""
+        generator = random.Random(0)
+        ingredients = range(1, SYNTHETIC_INGREDIENTS + 1)
+        weights = [1 / rank for rank in ingredients]
+        return (
+            (recipe_id, ingredient)
+            for recipe_id in range(1, SYNTHETIC_RECIPES + 1)
+            for ingredient in generator.choices(
+                ingredients, weights, k=SYNTHETIC_PER_RECIPE)
+        )
+
+    def measure(self, function, repeat, cold):
+        function()
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = function()
+                if getattr(response, 'streaming', False):
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, len(context.captured_queries))
+            status_code = getattr(response, 'status_code', 200)
+            if status_code >= 400:
+                raise CommandError(f'Ответ {status_code}: {response}')
+        return {
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'max_queries': queries,
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:32} median {result["median_ms"]:9.3f} ms  '
+            f'p95 {result["p95_ms"]:9.3f} ms  '
+            f'queries {result["max_queries"]}')
+
+    def compare(self, results, path, threshold):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            if result['max_queries'] > base['max_queries']:
+                regressions.append(
+                    f'{name}: запросов {base["max_queries"]} -> '
+                    f'{result["max_queries"]}')
+            if result['median_ms'] > base['median_ms'] * threshold:
+                regressions.append(
+                    f'{name}: медиана {base["median_ms"]} -> '
+                    f'{result["median_ms"]} ms')
+        if regressions:
+            raise CommandError(
+                'Регрессии производительности:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий не обнаружено.'))
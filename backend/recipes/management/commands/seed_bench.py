@@ -0,0 +1,179 @@
+import os
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.cache import response_cache
+from recipes.cart_totals import rebuild
+from recipes.changes import reset_changes
+from recipes.counters import COUNTERS, recount
+from recipes.models import (Favorite, Ingredient, IngredientForRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.search import update_ingredient_ids, update_search_vector
+from users.models import CustomUser, Follow
+
+BENCH_IMAGE = 'bench.png'
+# 1x1 PNG, чтобы у рецептов был существующий файл изображения.
+BENCH_IMAGE_CONTENT = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360f8cfc0f01f0005000201e5270d'
+    'e80000000049454e44ae426082'
+)
+BENCH_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+def zipf_weights(size, skew):
+    return [1 / (rank ** skew) for rank in range(1, size + 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, рецептами, '
+        'избранным, корзинами и подписками для бенчмарков.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=10)
+        parser.add_argument('--favorites-per-user', type=int, default=30)
+        parser.add_argument('--cart-per-user', type=int, default=10)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель распределения Ципфа для популярности '
+                 'авторов и рецептов.',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+        if not default_storage.exists(BENCH_IMAGE):
+            default_storage.save(BENCH_IMAGE, ContentFile(BENCH_IMAGE_CONTENT))
+
+        with transaction.atomic():
+            prefix = f'bench{int(time.time())}'
+            users = self.create_users(prefix, options['users'])
+            recipes = self.create_recipes(
+                prefix, users, options['recipes'],
+                options['ingredients_per_recipe'],
+                options['skew'],
+            )
+            self.create_relations(users, recipes, options)
+            for counter in COUNTERS:
+                recount(*counter)
+            update_search_vector()
+            update_ingredient_ids()
+            rebuild(batch_size=self.batch_size)
+
+        # bulk_create не отправляет сигналов: сбрасываем кэш тегов,
+        # ингредиентов и рецептов и заставляем индексы перестроиться.
+        for model in (Tag, Ingredient, Recipe):
+            response_cache.invalidate(model._meta.label_lower)
+        reset_changes()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, рецептов: {len(recipes)} '
+            f'за {time.perf_counter() - started:.1f} с.'
+        ))
+        if os.path.exists(settings.SIMILAR_INDEX_PATH):
+            self.stdout.write(
+                'Файл индекса похожих рецептов устарел, пересоберите его: '
+                'python manage.py build_similar_index')
+
+    def bulk_create(self, model, objects, **kwargs):
+        model.objects.bulk_create(
+            objects, batch_size=self.batch_size, **kwargs)
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {len(objects)}')
+
+    def create_users(self, prefix, count):
+        password = make_password(prefix)
+        self.bulk_create(CustomUser, [
+            CustomUser(
+                username=f'{prefix}_{number}',
+                email=f'{prefix}_{number}@example.com',
+                first_name='Bench',
+                last_name=str(number),
+                password=password,
+            ) for number in range(count)
+        ])
+        return list(CustomUser.objects.filter(
+            username__startswith=f'{prefix}_').values_list('id', flat=True))
+
+    def create_recipes(self, prefix, users, count, per_recipe, skew):
+        tags = list(Tag.objects.values_list('id', flat=True))
+        if not tags:
+            Tag.objects.bulk_create(
+                [Tag(name=name, color=color, slug=slug)
+                 for name, color, slug in BENCH_TAGS],
+                ignore_conflicts=True,
+            )
+            tags = list(Tag.objects.values_list('id', flat=True))
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+
+        authors = self.random.choices(
+            users, weights=zipf_weights(len(users), skew), k=count)
+        self.bulk_create(Recipe, [
+            Recipe(
+                author_id=author,
+                name=f'{prefix} рецепт {number}',
+                image=BENCH_IMAGE,
+                text='Синтетический рецепт для бенчмарка.',
+                cooking_time=self.random.randint(5, 180),
+            ) for number, author in enumerate(authors)
+        ])
+        recipes = list(Recipe.objects.filter(
+            name__startswith=f'{prefix} ').values_list('id', flat=True))
+
+        self.bulk_create(Recipe.tags.through, [
+            Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+            for recipe in recipes
+            for tag in self.random.sample(
+                tags, self.random.randint(1, len(tags)))
+        ])
+        self.bulk_create(IngredientForRecipe, [
+            IngredientForRecipe(
+                recipe_id=recipe,
+                ingredient_id=ingredient,
+                amount=self.random.randint(1, 500),
+            )
+            for recipe in recipes
+            for ingredient in self.random.sample(
+                ingredients, min(per_recipe, len(ingredients)))
+        ])
+        return recipes
+
+    def create_relations(self, users, recipes, options):
+        recipe_weights = zipf_weights(len(recipes), options['skew'])
+        author_weights = zipf_weights(len(users), options['skew'])
+        relations = (
+            (Favorite, 'recipe_id', recipes, recipe_weights,
+             options['favorites_per_user']),
+            (ShoppingCart, 'recipe_id', recipes, recipe_weights,
+             options['cart_per_user']),
+            (Follow, 'author_id', users, author_weights,
+             options['follows_per_user']),
+        )
+        for model, field, population, weights, per_user in relations:
+            self.bulk_create(model, [
+                model(user_id=user, **{field: target})
+                for user in users
+                for target in set(self.random.choices(
+                    population, weights=weights, k=per_user))
+                if not (model is Follow and target == user)
+            ], ignore_conflicts=True)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from recipes.search import (full_text_supported, update_ingredient_ids,
+                            update_search_vector)
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет поисковый столбец и массив ингредиентов рецептов '
+        '(только для PostgreSQL).'
+    )
+
+    def handle(self, *args, **options):
+        if not full_text_supported():
+            self.stdout.write(
+                'База не PostgreSQL: поиск идёт по индексу в памяти.')
+            return
+        update_search_vector()
+        update_ingredient_ids()
+        self.stdout.write(self.style.SUCCESS('Поисковые столбцы обновлены.'))
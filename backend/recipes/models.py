@@ -1,9 +1,39 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
 from users.models import CustomUser
 
 
+class SearchVectorIndex(GinIndex):
+    """GIN-индекс поискового столбца или массива.
+
+    На базах без GIN (SQLite в разработке) создаётся обычным индексом,
+    чтобы Meta.indexes и миграции не зависели от окружения.
+    """
+
+    def create_sql(self, model, schema_editor, **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return models.Index.create_sql(
+                self, model, schema_editor, **kwargs)
+        return super().create_sql(model, schema_editor, **kwargs)
+
+
+class PortableArrayField(ArrayField):
+    """Массив Postgres.
+
+    На других базах столбец остаётся пустым, и значение передаётся без
+    приведения ::тип[], которого SQLite не понимает.
+    """
+
+    def get_placeholder(self, value, compiler, connection):
+        if connection.vendor != 'postgresql':
+            return '%s'
+        return super().get_placeholder(value, compiler, connection)
+
+
 class Tag(models.Model):
     name = models.CharField(
         verbose_name='Название',
@@ -18,9 +48,11 @@ class Tag(models.Model):
         verbose_name='Slug тэга',
         help_text='Введите Slug тэга',
         max_length=200,
+        unique=True,
     )
 
     class Meta:
+        ordering = ['id']
         verbose_name = 'Тэг'
         verbose_name_plural = 'Тэги'
 
@@ -51,6 +83,21 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        """Подгружает автора, теги и ингредиенты для сериализатора."""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            'author__purchases',
+            models.Prefetch(
+                'ingredientforrecipe_set',
+                queryset=IngredientForRecipe.objects.select_related(
+                    'ingredient')
+            ),
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE,
@@ -63,6 +110,10 @@ class Recipe(models.Model):
         verbose_name='Картинка',
         help_text='Выберите изображение'
     )
+    image_variants_name = models.CharField(
+        max_length=100, blank=True, editable=False,
+        verbose_name='Изображение с готовыми копиями',
+    )
     text = models.TextField(
         max_length=1000, verbose_name='Описание рецепта'
     )
@@ -86,16 +137,42 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         auto_now_add=True, verbose_name='Дата публикации'
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном', default=0, editable=False
+    )
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Копия id ингредиентов из IngredientForRecipe для фильтра
+    # ?ingredients=: на Postgres его отвечает GIN-индекс по @>.
+    ingredient_ids = PortableArrayField(
+        models.BigIntegerField(), null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date'], name='recipe_author_date_idx'
+            ),
+            SearchVectorIndex(
+                fields=['search_vector'], name='recipe_search_idx'),
+            SearchVectorIndex(
+                fields=['ingredient_ids'], name='recipe_ingredient_ids_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+# Наибольшее значение PositiveSmallIntegerField во всех поддерживаемых базах.
+INGREDIENT_AMOUNT_MAX = 32767
+
+
 class IngredientForRecipe(models.Model):
     ingredient = models.ForeignKey(
         Ingredient,
@@ -112,6 +189,12 @@ class IngredientForRecipe(models.Model):
 
     class Meta:
         verbose_name = 'Количество ингредиента в рецепте'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_ingredient_in_recipe'
+            )
+        ]
 
     def __str__(self):
         return f'{self.ingredient} в {self.recipe}'
@@ -162,6 +245,42 @@ class ShoppingCart(models.Model):
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_shopping_cart_recipes'
+            )
+        ]
 
     def __str__(self):
         return f'{self.recipe.name} в списке покупок у {self.user}'
+
+
+class CartIngredientTotal(models.Model):
+    user = models.ForeignKey(
+        CustomUser,
+        verbose_name='Пользователь',
+        related_name='cart_totals',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество', default=0
+    )
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_ingredient_total'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} у {self.user}: {self.amount}'
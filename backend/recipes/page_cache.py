@@ -0,0 +1,193 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import urlencode
+from foodgram_api.metrics import measure
+from rest_framework import status
+
+from .cache import entry_response, make_entry, response_cache
+from .models import Ingredient, Recipe, Tag
+
+RECIPE_NAMESPACE = Recipe._meta.label_lower
+LIST_PARAMS = frozenset(('tags', 'author', 'page', 'limit'))
+
+
+def author_namespace(author_id):
+    return f'{RECIPE_NAMESPACE}:author:{author_id}'
+
+
+def tag_namespace(slug):
+    return f'{RECIPE_NAMESPACE}:tag:{slug}'
+
+
+def recipe_namespace(recipe_id):
+    return f'{RECIPE_NAMESPACE}:recipe:{recipe_id}'
+
+
+class PageCache:
+    """Кэш целых ответов ленты рецептов для анонимных пользователей.
+
+    В ключ входят нормализованная строка запроса и поколения только тех
+    пространств имён, от которых зависит ответ: автора, тегов из фильтра
+    или конкретного рецепта. Сохранение рецепта увеличивает поколения
+    его автора, тегов и самого рецепта, не сбрасывая остальные страницы.
+    Пересчитывает промах один процесс; остальные тем временем отдают
+    последнюю копию страницы, а если её нет, ждут не дольше
+    wait_timeout и считают сами, не занимая воркер надолго.
+    """
+
+    lock_timeout = 10
+    wait_timeout = 0.5
+    poll_interval = 0.05
+
+    @property
+    def backend(self):
+        return caches[settings.PAGE_CACHE_ALIAS]
+
+    def list_key(self, request):
+        """Ключ для списка или None, если ответ не кэшируется."""
+        params = request.query_params
+        if request.user.is_authenticated or not set(params) <= LIST_PARAMS:
+            return None
+        values = {
+            name: params.getlist(name) for name in ('author', 'page', 'limit')
+        }
+        if any(len(value) > 1 or not value[0].isdigit()
+               for value in values.values() if value):
+            return None
+        tags = sorted(set(params.getlist('tags')))
+        namespaces = [Tag._meta.label_lower, Ingredient._meta.label_lower]
+        if values['author']:
+            namespaces.append(author_namespace(values['author'][0]))
+        namespaces.extend(tag_namespace(slug) for slug in tags)
+        if not values['author'] and not tags:
+            namespaces.append(RECIPE_NAMESPACE)
+        query = urlencode(sorted(
+            [(name, value[0]) for name, value in values.items() if value]
+            + [('tags', slug) for slug in tags]
+        ))
+        return self.make_key(request, query, namespaces)
+
+    def detail_key(self, request, pk):
+        if request.user.is_authenticated or request.query_params:
+            return None
+        namespaces = [
+            Tag._meta.label_lower, Ingredient._meta.label_lower,
+            recipe_namespace(pk),
+        ]
+        return self.make_key(request, '', namespaces)
+
+    def make_key(self, request, query, namespaces):
+        # Ссылки пагинации абсолютные, поэтому в ключ входит и хост.
+        url = request.build_absolute_uri(request.path)
+        generations = ':'.join(
+            str(response_cache.generation(ns)) for ns in namespaces)
+        page = hashlib.md5(f'{url}?{query}'.encode()).hexdigest()
+        version = hashlib.md5(generations.encode()).hexdigest()
+        return f'page-cache:{page}:{version}'
+
+    def stale_key(self, key):
+        """Ключ последней копии страницы, без поколений."""
+        return f'{key.rsplit(":", 1)[0]}:latest'
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, entry):
+        self.backend.set_many({key: entry, self.stale_key(key): entry})
+
+    def acquire(self, key):
+        return self.backend.add(f'{key}:lock', 1, self.lock_timeout)
+
+    def release(self, key):
+        self.backend.delete(f'{key}:lock')
+
+    def fetch(self, key, compute):
+        """Запись из кэша; при промахе compute() вызывает один процесс.
+
+        compute возвращает запись или None, если ответ не кэшируется.
+        Пока страницу считает другой процесс, отдаётся её прошлая копия;
+        без копии результат ждётся не дольше wait_timeout.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        locked = self.acquire(key)
+        if not locked:
+            entry = self.get(self.stale_key(key))
+            if entry is not None:
+                return entry
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                entry = self.get(key)
+                if entry is not None:
+                    return entry
+        try:
+            entry = compute()
+            if entry is not None:
+                self.set(key, entry)
+            return entry
+        finally:
+            if locked:
+                self.release(key)
+
+
+page_cache = PageCache()
+
+
+class PageCacheMixin:
+    """Отдаёт анонимные list и retrieve из page_cache с поддержкой ETag."""
+
+    def list(self, request, *args, **kwargs):
+        return self.page_response(
+            page_cache.list_key(request),
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.page_response(
+            page_cache.detail_key(request, kwargs[self.lookup_field]),
+            super().retrieve, request, *args, **kwargs)
+
+    def page_response(self, key, view, request, *args, **kwargs):
+        if key is None:
+            return view(request, *args, **kwargs)
+        responses = []
+
+        def compute():
+            response = view(request, *args, **kwargs)
+            responses.append(response)
+            if response.status_code != status.HTTP_200_OK:
+                return None
+            with measure(request, 'render_duration'):
+                return make_entry(response.data)
+
+        entry = page_cache.fetch(key, compute)
+        if entry is None:
+            return responses[-1]
+        return entry_response(request, entry)
+
+
+def recipe_tag_slugs(recipe_id, tag_ids=None):
+    if tag_ids is None:
+        tags = Tag.objects.filter(recipes=recipe_id)
+    else:
+        tags = Tag.objects.filter(pk__in=tag_ids)
+    return list(tags.values_list('slug', flat=True))
+
+
+def invalidate_recipe_pages(recipe_id, author_id, tag_slugs=()):
+    """Сбрасывает страницы рецепта, его автора и тегов сейчас и
+    повторно после коммита транзакции."""
+    namespaces = [recipe_namespace(recipe_id), author_namespace(author_id)]
+    namespaces.extend(tag_namespace(slug) for slug in tag_slugs)
+
+    def invalidate():
+        for namespace in namespaces:
+            response_cache.invalidate(namespace)
+
+    invalidate()
+    transaction.on_commit(invalidate)
@@ -1,5 +1,56 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+
+from django.core.cache import cache
+from django.utils.http import urlencode
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+
+def is_cursor_requested(request):
+    return request.query_params.get('pagination') == 'cursor'
 
 
 class PageNumberPaginatorModified(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class CursorPaginatorModified(CursorPagination):
+    """Курсорная пагинация с приблизительным общим количеством.
+
+    Количество объектов кэшируется на count_timeout секунд для каждого
+    пользователя и набора фильтров, поэтому листание не вызывает
+    COUNT(*) на каждой странице.
+    """
+
+    page_size_query_param = 'limit'
+    count_timeout = 60
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = cache.get_or_set(
+            self.get_count_key(request), queryset.count, self.count_timeout)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_key(self, request):
+        params = sorted(
+            (key, value) for key, value in request.query_params.lists()
+            if key not in (self.cursor_query_param, 'pagination')
+        )
+        key = f'{request.user.pk}:{request.path}?{urlencode(params, True)}'
+        return f'paginator-count:{hashlib.md5(key.encode()).hexdigest()}'
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class RecipeCursorPaginator(CursorPaginatorModified):
+    ordering = ('-pub_date', '-id')
+
+
+class SubscriptionCursorPaginator(CursorPaginatorModified):
+    ordering = 'username'
+    page_size = 10
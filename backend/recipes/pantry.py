@@ -0,0 +1,233 @@
+import heapq
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+
+from django.conf import settings
+
+from .changes import changed_since, log_version
+from .models import IngredientForRecipe
+
+NONZERO_BYTE = re.compile(rb'[^\x00]')
+BYTE_BITS = tuple(
+    tuple(bit for bit in range(7, -1, -1) if byte >> bit & 1)
+    for byte in range(256)
+)
+# Ингредиент, который есть хотя бы в 1/DENSE_RATIO рецептов, хранится
+# готовой картой: собирать её из массива на каждый запрос дорого.
+DENSE_RATIO = 256
+
+
+def to_bitmap(rows):
+    """int с единичными битами в позициях rows."""
+    if not rows:
+        return 0
+    data = bytearray(max(rows) // 8 + 1)
+    for row in rows:
+        data[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(data, 'little')
+
+
+def top_positions(bitmap, limit):
+    """До limit позиций единичных битов, начиная со старших."""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'big')
+    last = len(data) - 1
+    positions = []
+    for match in NONZERO_BYTE.finditer(data):
+        base = (last - match.start()) * 8
+        positions.extend(base + bit for bit in BYTE_BITS[data[match.start()]])
+        if len(positions) >= limit:
+            return positions[:limit]
+    return positions
+
+
+def add_bitmap(planes, bitmap):
+    """Прибавляет bitmap к побитовому счётчику planes (младший разряд
+    первый): каждый рецепт получает свой счётчик совпадений."""
+    carry = bitmap
+    for index, plane in enumerate(planes):
+        planes[index] = plane ^ carry
+        carry &= plane
+        if not carry:
+            return
+    planes.append(carry)
+
+
+class PantryIndex:
+    """Инвертированный индекс ингредиент -> строки рецептов для подбора
+    рецептов по имеющимся продуктам.
+
+    Строка рецепта — его номер по возрастанию id. Строки ингредиента
+    хранятся битовой картой в int, а у редких — отсортированным
+    array('i'), из которого карта собирается при запросе. Совпадения
+    считаются побитовыми сумматорами по картам, а рецепты с одинаковыми
+    долей покрытия и числом недостающих выбираются пересечением с
+    картой размеров, так что работа на Python не зависит от числа
+    рецептов. Рецепты, изменённые
+    после сборки (журнал recipes.changes), хранятся множествами поверх
+    индекса, пока их не больше PANTRY_OVERLAY_LIMIT.
+    """
+
+    def __init__(self, pairs=None):
+        """pairs — (id рецепта, id ингредиента) по возрастанию рецепта;
+        без них индекс строится по базе при первом запросе."""
+        self._state = None if pairs is None else self.build(pairs)
+        self._lock = threading.Lock()
+
+    def build(self, pairs):
+        version = log_version()
+        recipe_ids = array('q')
+        rows_by_size = {}
+        postings = {}
+        for row, (recipe_id, group) in enumerate(
+                groupby(pairs, key=lambda pair: pair[0])):
+            ingredients = {ingredient for _, ingredient in group}
+            recipe_ids.append(recipe_id)
+            rows_by_size.setdefault(len(ingredients), []).append(row)
+            for ingredient in ingredients:
+                postings.setdefault(ingredient, array('i')).append(row)
+        dense = len(recipe_ids) // DENSE_RATIO
+        return {
+            'version': version,
+            'recipe_ids': recipe_ids,
+            'sizes': {
+                size: to_bitmap(rows) for size, rows in rows_by_size.items()
+            },
+            'postings': {
+                id_: to_bitmap(rows) if len(rows) > dense else rows
+                for id_, rows in postings.items()
+            },
+            'overlay': {},
+            'live': (1 << len(recipe_ids)) - 1,
+        }
+
+    def _build(self):
+        pairs = IngredientForRecipe.objects.order_by(
+            'recipe_id').values_list('recipe_id', 'ingredient_id')
+        return self.build(pairs.iterator(chunk_size=10000))
+
+    def _ensure_current(self):
+        version = log_version()
+        state = self._state
+        if state is not None and state['version'] == version:
+            return state
+        with self._lock:
+            state = self._state
+            if state is None:
+                state = self._state = self._build()
+            if state['version'] == version:
+                return state
+            changed = changed_since(state['version'], version)
+            if (changed is None or len(state['overlay'].keys() | changed)
+                    > settings.PANTRY_OVERLAY_LIMIT):
+                state = self._state = self._build()
+                return state
+            recipe_ids = state['recipe_ids']
+            stale = []
+            for id_ in changed:
+                row = bisect_left(recipe_ids, id_)
+                if row < len(recipe_ids) and recipe_ids[row] == id_:
+                    stale.append(row)
+            state = self._state = {
+                **state,
+                'version': version,
+                'overlay': {
+                    **state['overlay'], **self._compositions(changed)},
+                'live': state['live'] & ~to_bitmap(stale),
+            }
+            return state
+
+    def _compositions(self, recipe_ids):
+        """Составы рецептов; пустое множество для удалённых."""
+        compositions = {id_: set() for id_ in recipe_ids}
+        for recipe_id, ingredient_id in IngredientForRecipe.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient_id'):
+            compositions[recipe_id].add(ingredient_id)
+        return {id_: frozenset(value) for id_, value in compositions.items()}
+
+    def reset(self):
+        with self._lock:
+            self._state = None
+
+    def match(self, ingredient_ids, limit, max_missing=None):
+        """[(id рецепта, доля покрытия, не хватает)] по убыванию доли,
+        затем по возрастанию недостающих, затем новые рецепты выше."""
+        state = self._ensure_current()
+        pantry = set(ingredient_ids)
+        planes = []
+        for id_ in pantry:
+            rows = state['postings'].get(id_, 0)
+            add_bitmap(
+                planes, rows if isinstance(rows, int) else to_bitmap(rows))
+        ranked = self.ranked(state, planes, len(pantry), limit, max_missing)
+        for recipe_id, ingredients in state['overlay'].items():
+            count = len(pantry.intersection(ingredients))
+            missing = len(ingredients) - count
+            if count and (max_missing is None or missing <= max_missing):
+                ranked.append((count / len(ingredients), -missing, recipe_id))
+        return [
+            (recipe_id, round(coverage, 4), -missing)
+            for coverage, missing, recipe_id in heapq.nlargest(limit, ranked)
+        ]
+
+    def containing(self, ingredient_ids):
+        """id рецептов, в которых есть все ингредиенты ingredient_ids."""
+        wanted = frozenset(ingredient_ids)
+        if not wanted:
+            return set()
+        state = self._ensure_current()
+        bitmap = state['live']
+        for id_ in wanted:
+            rows = state['postings'].get(id_, 0)
+            bitmap &= rows if isinstance(rows, int) else to_bitmap(rows)
+            if not bitmap:
+                break
+        recipe_ids = state['recipe_ids']
+        result = {
+            recipe_ids[row]
+            for row in top_positions(bitmap, len(recipe_ids))
+        }
+        result.update(
+            recipe_id for recipe_id, ingredients in state['overlay'].items()
+            if wanted <= ingredients
+        )
+        return result
+
+    def ranked(self, state, planes, pantry_size, limit, max_missing):
+        """Первые limit рецептов индекса как (доля, -недостающих, id)."""
+        live, recipe_ids = state['live'], state['recipe_ids']
+        groups = sorted(
+            (-count / size, size - count, count, size)
+            for size in state['sizes']
+            for count in range(1, min(size, pantry_size) + 1)
+            if max_missing is None or size - count <= max_missing
+        )
+        equal = {}
+        ranked = []
+        # Группы с одной долей и числом недостающих (1/2 и 2/4) сливаются
+        # в одну карту, чтобы новые рецепты шли первыми среди всех них.
+        for (coverage, missing), group in groupby(
+                groups, key=lambda group: group[:2]):
+            bitmap = 0
+            for _, _, count, size in group:
+                if count not in equal:
+                    # Строки, где счётчик совпадений равен count.
+                    rows = live
+                    for bit, plane in enumerate(planes):
+                        rows &= plane if count >> bit & 1 else ~plane
+                    equal[count] = rows if count < 1 << len(planes) else 0
+                bitmap |= equal[count] & state['sizes'][size]
+            if not bitmap:
+                continue
+            ranked.extend(
+                (-coverage, -missing, recipe_ids[row])
+                for row in top_positions(bitmap, limit - len(ranked)))
+            if len(ranked) >= limit:
+                break
+        return ranked
+
+
+pantry_index = PantryIndex()
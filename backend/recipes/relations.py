@@ -0,0 +1,49 @@
+from typing import FrozenSet, NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from users.models import Follow
+
+from .models import Favorite, ShoppingCart
+
+
+class Relations(NamedTuple):
+    favorites: FrozenSet[int] = frozenset()
+    shopping_cart: FrozenSet[int] = frozenset()
+    following: FrozenSet[int] = frozenset()
+
+
+def relations_key(user_id):
+    return f'user-relations:{user_id}'
+
+
+def load_relations(user):
+    """Id избранных рецептов, рецептов в корзине и авторов в подписках."""
+    key = relations_key(user.pk)
+    relations = cache.get(key)
+    if relations is None:
+        relations = Relations(
+            favorites=frozenset(Favorite.objects.filter(
+                user=user).values_list('recipe_id', flat=True)),
+            shopping_cart=frozenset(ShoppingCart.objects.filter(
+                user=user).values_list('recipe_id', flat=True)),
+            following=frozenset(Follow.objects.filter(
+                user=user).values_list('author_id', flat=True)),
+        )
+        cache.set(key, relations, settings.USER_RELATIONS_TIMEOUT)
+    return relations
+
+
+def get_relations(request):
+    """Связи текущего пользователя, загружаемые один раз за запрос."""
+    if request is None or request.user.is_anonymous:
+        return Relations()
+    relations = getattr(request, 'user_relations', None)
+    if relations is None:
+        relations = load_relations(request.user)
+        request.user_relations = relations
+    return relations
+
+
+def invalidate_relations(user_id):
+    cache.delete(relations_key(user_id))
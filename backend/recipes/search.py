@@ -0,0 +1,234 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connections
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, When
+
+from .changes import changed_since, log_version
+from .models import IngredientForRecipe, Recipe
+from .pantry import pantry_index
+
+SEARCH_CONFIG = 'russian'
+NAME_WEIGHT = 2
+TEXT_WEIGHT = 1
+TOKEN_RE = re.compile(r'\w+')
+
+
+def full_text_supported(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+def search_vector():
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vector(pk=None):
+    """Пересчитывает поисковый столбец рецепта (или всех рецептов)."""
+    if not full_text_supported():
+        return
+    queryset = Recipe.objects.all()
+    if pk is not None:
+        queryset = queryset.filter(pk=pk)
+    queryset.update(search_vector=search_vector())
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold())
+
+
+class RecipeSearchIndex:
+    """Инвертированный индекс рецептов в памяти процесса для поиска без
+    Postgres: слова названия и описания -> {id рецепта: вес}.
+
+    Рецепты, изменённые после построения, берутся из журнала изменений
+    и переиндексируются по одному; целиком индекс строится заново, только
+    если журнал не покрывает пропущенные версии.
+    """
+
+    def __init__(self):
+        self._state = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _weights(name, text):
+        weights = {}
+        for weight, value in ((NAME_WEIGHT, name), (TEXT_WEIGHT, text)):
+            for term in tokenize(value):
+                weights[term] = weights.get(term, 0) + weight
+        return weights
+
+    def _documents(self, queryset):
+        return {
+            id_: self._weights(name, text)
+            for id_, name, text in queryset.values_list(
+                'id', 'name', 'text').iterator()
+        }
+
+    def _build(self):
+        version = log_version()
+        documents = self._documents(Recipe.objects.all())
+        postings = defaultdict(dict)
+        for id_, weights in documents.items():
+            for term, weight in weights.items():
+                postings[term][id_] = weight
+        return {
+            'version': version,
+            'documents': documents,
+            'postings': dict(postings),
+            'terms': tuple(sorted(postings)),
+        }
+
+    def _update(self, state, version, changed):
+        """Состояние с переиндексированными рецептами changed; списки
+        рецептов копируются только для затронутых слов."""
+        documents = dict(state['documents'])
+        postings = dict(state['postings'])
+        fresh = self._documents(Recipe.objects.filter(pk__in=changed))
+        touched = set()
+        for id_ in changed:
+            old = documents.pop(id_, {})
+            new = fresh.get(id_, {})
+            for term in old.keys() | new.keys():
+                if term not in touched:
+                    touched.add(term)
+                    postings[term] = dict(postings.get(term, {}))
+                postings[term].pop(id_, None)
+                if term in new:
+                    postings[term][id_] = new[term]
+            if new:
+                documents[id_] = new
+        for term in touched:
+            if not postings[term]:
+                del postings[term]
+        terms = state['terms']
+        if any((term in postings) != (term in state['postings'])
+               for term in touched):
+            terms = tuple(sorted(postings))
+        return {
+            'version': version,
+            'documents': documents,
+            'postings': postings,
+            'terms': terms,
+        }
+
+    def _ensure_current(self):
+        version = log_version()
+        state = self._state
+        if state is not None and state['version'] == version:
+            return state
+        with self._lock:
+            state = self._state
+            if state is None:
+                state = self._state = self._build()
+            if state['version'] == version:
+                return state
+            changed = changed_since(state['version'], version)
+            if changed is None:
+                self._state = self._build()
+            else:
+                self._state = self._update(state, version, changed)
+            return self._state
+
+    def reset(self):
+        with self._lock:
+            self._state = None
+
+    @staticmethod
+    def _term_scores(state, query_term):
+        """Веса рецептов для слов, начинающихся с query_term."""
+        terms = state['terms']
+        scores = {}
+        position = bisect_left(terms, query_term)
+        while (position < len(terms)
+               and terms[position].startswith(query_term)):
+            for id_, weight in state['postings'][terms[position]].items():
+                scores[id_] = max(scores.get(id_, 0), weight)
+            position += 1
+        return scores
+
+    def search(self, query, limit):
+        """id рецептов, где встречаются все слова запроса (по префиксу),
+        по убыванию суммарного веса, не больше limit."""
+        state = self._ensure_current()
+        scores = None
+        for term in dict.fromkeys(tokenize(query)):
+            term_scores = self._term_scores(state, term)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    id_: score + term_scores[id_]
+                    for id_, score in scores.items() if id_ in term_scores
+                }
+            if not scores:
+                return []
+        if scores is None:
+            return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [id_ for id_, _ in ranked[:limit]]
+
+
+recipe_search_index = RecipeSearchIndex()
+
+
+def update_ingredient_ids(pk=None):
+    """Пересчитывает массив id ингредиентов рецепта (или всех рецептов).
+
+    Вызывается после записи строк IngredientForRecipe в той же
+    транзакции: bulk_create и bulk_update сигналов не шлют.
+    """
+    if not full_text_supported():
+        return
+    queryset = Recipe.objects.all()
+    if pk is not None:
+        queryset = queryset.filter(pk=pk)
+    queryset.update(ingredient_ids=Subquery(
+        IngredientForRecipe.objects.filter(
+            recipe=OuterRef('pk')
+        ).values('recipe').annotate(
+            ids=ArrayAgg('ingredient_id')
+        ).values('ids')
+    ))
+
+
+def with_ingredients(queryset, ingredient_ids):
+    """Рецепты, в которых есть все перечисленные ингредиенты.
+
+    На Postgres — ingredient_ids @> [...] по GIN-индексу массива, на
+    остальных базах — пересечение карт индекса pantry_index, который
+    подхватывает изменённые рецепты без полной пересборки.
+    """
+    ingredient_ids = sorted(set(ingredient_ids))
+    if full_text_supported(queryset.db):
+        return queryset.filter(ingredient_ids__contains=ingredient_ids)
+    return queryset.filter(pk__in=pantry_index.containing(ingredient_ids))
+
+
+def search_recipes(queryset, query, limit):
+    """Полнотекстовый поиск с ранжированием по релевантности.
+
+    На Postgres ищет по индексированному столбцу search_vector,
+    на остальных базах — по индексу в памяти, не больше limit рецептов.
+    """
+    if full_text_supported(queryset.db):
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', '-pub_date', '-id')
+    ids = recipe_search_index.search(query, limit)
+    if not ids:
+        return queryset.none()
+    ranking = Case(
+        *[When(pk=pk, then=position) for position, pk in enumerate(ids)],
+        output_field=IntegerField(),
+    )
+    return queryset.filter(pk__in=ids).order_by(ranking)
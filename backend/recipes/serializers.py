@@ -1,33 +1,36 @@
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserSerializer as BaseUserSerializer
-from drf_extra_fields.fields import Base64ImageField
+from foodgram_api.metrics import TimedListSerializer, TimedSerializerMixin
 from rest_framework import serializers
-from users.models import Follow
 
-from .models import (Favorite, Ingredient, IngredientForRecipe, Recipe,
-                     ShoppingCart, Tag)
+from .cart_totals import change_recipe
+from .fields import ImageVariantsField, RecipeImageField
+from .images import schedule_variants
+from .models import (INGREDIENT_AMOUNT_MAX, Ingredient, IngredientForRecipe,
+                     Recipe, Tag)
+from .relations import get_relations
+from .search import update_ingredient_ids
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     id = serializers.IntegerField()
 
     class Meta:
         model = Tag
+        list_serializer_class = TimedListSerializer
         fields = ('id', 'name', 'color', 'slug')
         read_only_fields = ('name', 'color', 'slug')
 
-    def validate_id(self, id_):
-        if not Tag.objects.filter(id=id_).exists():
-            msg = f'Tag with id `{id_}` does not exist.'
-            raise serializers.ValidationError(msg)
-        return id_
 
-
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     id = serializers.IntegerField()
     amount = serializers.IntegerField(write_only=True)
 
     class Meta:
         model = Ingredient
+        list_serializer_class = TimedListSerializer
         fields = [
             'id',
             'name',
@@ -36,12 +39,6 @@ class IngredientSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['name', 'measurement_unit']
 
-    def validate_id(self, id_):
-        if not Ingredient.objects.filter(id=id_).exists():
-            msg = f'Ingredient with id `{id_}` does not exist.'
-            raise serializers.ValidationError(msg)
-        return id_
-
     def validate_amount(self, amount):
         if amount <= 0:
             raise serializers.ValidationError(
@@ -56,20 +53,35 @@ class IngredientForRecipeSerializer(serializers.ModelSerializer):
         fields = ['id', 'ingredient', 'recipe', 'amount']
 
 
-class RecipeSerializer(serializers.ModelSerializer):
-    ingredients = IngredientSerializer(many=True)
-    image = Base64ImageField(
+class IngredientAmountSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField()
+
+    def validate_amount(self, amount):
+        if amount <= 0:
+            raise serializers.ValidationError(
+                'Количество ингридиента должно быть больше нуля!')
+        return amount
+
+
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    ingredients = IngredientAmountSerializer(many=True, write_only=True)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), write_only=True)
+    image = RecipeImageField(
         max_length=None,
         required=True,
         allow_empty_file=False,
         use_url=True,
     )
+    image_variants = ImageVariantsField()
     author = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
+        list_serializer_class = TimedListSerializer
         fields = [
             'id',
             'tags',
@@ -77,6 +89,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time',
             'is_favorited',
@@ -84,26 +97,56 @@ class RecipeSerializer(serializers.ModelSerializer):
         ]
 
     def get_author(self, recipe):
-        return UserSerializer(recipe.author, omit=['recipes']).data
+        return UserSerializer(
+            recipe.author, omit=['recipes'], context=self.context).data
 
     def get_is_favorited(self, recipe):
-        request = self.context.get('request')
-
-        if request is None or request.user.is_anonymous:
-            return False
-
-        user = request.user
-        return Favorite.objects.filter(recipe=recipe, user=user).exists()
+        relations = get_relations(self.context.get('request'))
+        return recipe.pk in relations.favorites
 
     def get_is_in_shopping_cart(self, recipe):
-        request = self.context.get('request')
-
-        if request is None or request.user.is_anonymous:
-            return False
-
-        user = request.user
-        return ShoppingCart.objects.filter(recipe=recipe, user=user).exists()
-
+        relations = get_relations(self.context.get('request'))
+        return recipe.pk in relations.shopping_cart
+
+    def validate(self, attrs):
+        if 'tags' in attrs:
+            tag_ids = list(dict.fromkeys(attrs['tags']))
+            tags = Tag.objects.in_bulk(tag_ids)
+            missing = [id_ for id_ in tag_ids if id_ not in tags]
+            if missing:
+                raise serializers.ValidationError({'tags': [
+                    f'Tag with id `{id_}` does not exist.' for id_ in missing
+                ]})
+            attrs['tags'] = [tags[id_] for id_ in tag_ids]
+
+        if 'ingredients' in attrs:
+            amounts = {}
+            for item in attrs['ingredients']:
+                id_ = item['id']
+                amounts[id_] = amounts.get(id_, 0) + item['amount']
+            ingredients = Ingredient.objects.in_bulk(list(amounts))
+            missing = [id_ for id_ in amounts if id_ not in ingredients]
+            if missing:
+                raise serializers.ValidationError({'ingredients': [
+                    f'Ingredient with id `{id_}` does not exist.'
+                    for id_ in missing
+                ]})
+            too_large = [
+                id_ for id_, amount in amounts.items()
+                if amount > INGREDIENT_AMOUNT_MAX
+            ]
+            if too_large:
+                raise serializers.ValidationError({'ingredients': [
+                    f'Количество ингредиента с id `{id_}` не может быть '
+                    f'больше {INGREDIENT_AMOUNT_MAX}' for id_ in too_large
+                ]})
+            attrs['ingredients'] = {
+                ingredients[id_]: amount for id_, amount in amounts.items()
+            }
+
+        return attrs
+
+    @transaction.atomic
     def create(self, validated_data):
         tags_data = validated_data.pop('tags')
 
@@ -111,50 +154,87 @@ class RecipeSerializer(serializers.ModelSerializer):
         author = self.context.get('request').user
 
         recipe = Recipe.objects.create(author=author, **validated_data)
-        recipe.save()
         recipe.tags.set(tags_data)
+        schedule_variants(recipe.image.name)
 
         IngredientForRecipe.objects.bulk_create([
             IngredientForRecipe(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
-                amount=ingredient['amount']) for ingredient in
-            ingredients_data
+                ingredient=ingredient,
+                amount=amount) for ingredient, amount in
+            ingredients_data.items()
         ])
+        update_ingredient_ids(recipe.pk)
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.pop('ingredients')
-        tags_data = validated_data.pop('tags')
+        ingredients_data = validated_data.pop('ingredients', None)
+        tags_data = validated_data.pop('tags', None)
 
-        IngredientForRecipe.objects.filter(recipe=instance).delete()
+        if ingredients_data is not None:
+            self.update_ingredients(instance, ingredients_data)
 
-        IngredientForRecipe.objects.bulk_create([
-            IngredientForRecipe(
-                recipe=instance,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
-                amount=ingredient['amount']) for ingredient in
-            ingredients_data
-        ])
+        if validated_data.get('image') is None:
+            validated_data.pop('image', None)
 
-        instance.name = validated_data.pop('name')
-        instance.text = validated_data.pop('text')
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save()
 
-        if validated_data.get('image') is not None:
-            instance.image = validated_data.pop('image')
+        if 'image' in validated_data:
+            schedule_variants(instance.image.name)
 
-        instance.cooking_time = validated_data.pop('cooking_time')
-        instance.save()
-        instance.tags.set(tags_data)
+        if tags_data is not None:
+            instance.tags.set(tags_data)
 
         return instance
 
+    def update_ingredients(self, recipe, ingredients_data):
+        """Записывает только изменившиеся строки IngredientForRecipe и
+        переносит разницу в итоги корзин с этим рецептом."""
+        current = {
+            row.ingredient_id: row
+            for row in IngredientForRecipe.objects.filter(recipe=recipe)
+        }
+        to_create = []
+        to_update = []
+        deltas = {}
+        for ingredient, amount in ingredients_data.items():
+            row = current.pop(ingredient.id, None)
+            if row is None:
+                to_create.append(IngredientForRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=amount))
+                deltas[ingredient.id] = amount
+            elif row.amount != amount:
+                deltas[ingredient.id] = amount - row.amount
+                row.amount = amount
+                to_update.append(row)
+
+        if current:
+            IngredientForRecipe.objects.filter(
+                pk__in=[row.pk for row in current.values()]).delete()
+            for ingredient_id, row in current.items():
+                deltas[ingredient_id] = -row.amount
+        IngredientForRecipe.objects.bulk_create(to_create)
+        IngredientForRecipe.objects.bulk_update(to_update, ['amount'])
+        change_recipe(recipe.pk, deltas)
+
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            'tags',
+            Prefetch(
+                'ingredientforrecipe_set',
+                queryset=IngredientForRecipe.objects.select_related(
+                    'ingredient')
+            ),
+        )
         data = super().to_representation(instance)
         tags_data = TagSerializer(instance.tags.all(), many=True).data
 
-        ings = instance.ingredientforrecipe_set.prefetch_related('ingredient').all() # noqa
+        ings = instance.ingredientforrecipe_set.all()
         ingredients_data = [
             {
                 **IngredientSerializer(ingredient_in_recipe.ingredient).data,
@@ -162,15 +242,28 @@ class RecipeSerializer(serializers.ModelSerializer):
             } for ingredient_in_recipe in ings
         ]
 
-        return {**data, 'tags': tags_data, 'ingredients': ingredients_data}
+        data = {**data, 'tags': tags_data, 'ingredients': ingredients_data}
+        return {field: data[field] for field in self.Meta.fields}
+
+
+class ShortRecipeSerializer(TimedSerializerMixin,
+                            serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
+    class Meta:
+        model = Recipe
+        list_serializer_class = TimedListSerializer
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+        read_only_fields = fields
 
 
-class UserSerializer(BaseUserSerializer):
+class UserSerializer(TimedSerializerMixin, BaseUserSerializer):
     is_subscribed = serializers.SerializerMethodField()
-    recipes = RecipeSerializer(many=True, read_only=True)
+    recipes = ShortRecipeSerializer(many=True, read_only=True)
     recipes_count = serializers.SerializerMethodField()
 
     class Meta(BaseUserSerializer.Meta):
+        list_serializer_class = TimedListSerializer
         fields = [
             'email',
             'id',
@@ -190,12 +283,8 @@ class UserSerializer(BaseUserSerializer):
             del self.fields[field]
 
     def get_is_subscribed(self, user):
-        request = self.context.get('request')
-
-        if request is None or request.user.is_anonymous:
-            return False
-
-        return Follow.objects.filter(user=request.user, author=user).exists()
+        relations = get_relations(self.context.get('request'))
+        return user.pk in relations.following
 
     def get_recipes_count(self, user):
-        return user.recipes.count()
+        return user.recipes_count
@@ -0,0 +1,184 @@
+import csv
+import hashlib
+import io
+import json
+from itertools import chain, islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from .cache import response_cache
+from .models import CartIngredientTotal, Ingredient, Recipe
+
+FOOTER = 'FoodGram, 2021'
+CHUNK_SIZE = 2000
+
+
+# Единица измерения -> (величина, множитель к базовой единице).
+UNITS = {
+    'г': ('mass', 1),
+    'кг': ('mass', 1000),
+    'мл': ('volume', 1),
+    'л': ('volume', 1000),
+}
+# Единицы для вывода, от крупной к базовой.
+DISPLAY_UNITS = {
+    'mass': (('кг', 1000), ('г', 1)),
+    'volume': (('л', 1000), ('мл', 1)),
+}
+
+
+def shopping_list_queryset(user):
+    """Суммы ингредиентов корзины из материализованных итогов."""
+    return CartIngredientTotal.objects.filter(
+        user=user, amount__gt=0
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit',
+        total_amount=F('amount'),
+    ).order_by('ingredient__name')
+
+
+def shopping_list_rows(user):
+    return normalize_amounts(
+        shopping_list_queryset(user).iterator(chunk_size=CHUNK_SIZE))
+
+
+def normalize_amounts(rows):
+    """Строки списка покупок с количеством в удобной единице.
+
+    Название ингредиента уникально, поэтому у каждой строки одна
+    единица измерения и складывать между собой нечего.
+    """
+    for row in rows:
+        amount, unit = humanize_amount(
+            row['total_amount'], row['ingredient__measurement_unit'].strip())
+        yield {
+            'name': row['ingredient__name'],
+            'amount': amount,
+            'measurement_unit': unit,
+        }
+
+
+def humanize_amount(amount, unit):
+    """Переводит количество в крупную единицу той же величины, если
+    его хватает хотя бы на одну (1500 г -> 1.5 кг, 0.5 кг -> 500 г).
+    Единицы вне UNITS (ложки, стаканы, «по вкусу») не меняются."""
+    dimension, factor = UNITS.get(unit, (None, 1))
+    if dimension is None:
+        return clean_number(amount), unit
+    amount *= factor
+    for unit, factor in DISPLAY_UNITS[dimension]:
+        if amount >= factor:
+            break
+    return clean_number(amount / factor), unit
+
+
+def clean_number(value):
+    value = round(value, 3)
+    return int(value) if value == int(value) else value
+
+
+def shopping_list_key(export_format, cart_ids):
+    """Ключ кэша, зависящий от состава корзины и версий рецептов."""
+    recipe_generation = response_cache.generation(Recipe._meta.label_lower)
+    ingredient_generation = response_cache.generation(
+        Ingredient._meta.label_lower)
+    cart = ','.join(str(pk) for pk in sorted(cart_ids))
+    digest = hashlib.md5(
+        f'{recipe_generation}:{ingredient_generation}:{cart}'.encode()
+    ).hexdigest()
+    return f'shopping-list:{export_format}:{digest}'
+
+
+def cached_stream(key, chunks):
+    """Отдаёт части ответа и после последней сохраняет ответ в кэш."""
+    parts = []
+    for part in chunks:
+        parts.append(part)
+        yield part
+    cache.set(key, b''.join(parts), settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def format_line(row):
+    return f'{row["name"]} - {row["amount"]} {row["measurement_unit"]}'
+
+
+def render_txt(rows):
+    for row in rows:
+        yield f'{format_line(row)} \n'.encode()
+    yield f'\n{FOOTER}'.encode()
+
+
+class Echo:
+    """Псевдофайл, возвращающий записанное значение."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['name', 'amount', 'measurement_unit']).encode()
+    for row in rows:
+        yield writer.writerow([
+            row['name'], row['amount'], row['measurement_unit'],
+        ]).encode()
+
+
+def render_json(rows):
+    yield b'['
+    separator = ''
+    for row in rows:
+        item = json.dumps(row, ensure_ascii=False)
+        yield f'{separator}{item}'.encode()
+        separator = ','
+    yield b']'
+
+
+PDF_FONT = 'DejaVuSans'
+PDF_MARGIN = 50
+PDF_FONT_SIZE = 11
+PDF_LEADING = 14
+PDF_LINES_PER_PAGE = int((A4[1] - 2 * PDF_MARGIN) // PDF_LEADING)
+
+
+def register_pdf_font():
+    """Регистрирует TrueType-шрифт с кириллицей: в стандартных шрифтах
+    PDF (Helvetica и др.) её нет, и названия выводились бы пустыми."""
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT, settings.SHOPPING_LIST_PDF_FONT))
+
+
+def render_pdf(rows):
+    """PDF со встроенным подмножеством шрифта; invariant убирает из
+    файла дату и случайный id, чтобы тот же список давал те же байты."""
+    register_pdf_font()
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, invariant=1)
+    lines = chain((format_line(row) for row in rows), ('', FOOTER))
+    while True:
+        page = list(islice(lines, PDF_LINES_PER_PAGE))
+        if not page:
+            break
+        text = pdf.beginText(PDF_MARGIN, A4[1] - PDF_MARGIN)
+        text.setFont(PDF_FONT, PDF_FONT_SIZE, PDF_LEADING)
+        for line in page:
+            text.textLine(line)
+        pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+    yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'json': ('application/json', render_json),
+    'pdf': ('application/pdf', render_pdf),
+}
@@ -0,0 +1,154 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from users.models import CustomUser, Follow
+
+from . import cart_totals
+from .cache import response_cache
+from .changes import record_change
+from .counters import change_counter
+from .feed import invalidate_feeds
+from .models import (Favorite, Ingredient, IngredientForRecipe, Recipe,
+                     ShoppingCart, Tag)
+from .page_cache import invalidate_recipe_pages, recipe_tag_slugs
+from .relations import invalidate_relations
+from .search import update_ingredient_ids, update_search_vector
+
+
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_response_cache(sender, **kwargs):
+    label = sender._meta.label_lower
+    response_cache.invalidate(label)
+    # Повторно после коммита: связанные строки (ингредиенты рецепта)
+    # пишутся в той же транзакции, и кэш не должен застать их до неё.
+    transaction.on_commit(lambda: response_cache.invalidate(label))
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_search_vector(sender, instance, **kwargs):
+    update_search_vector(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver([post_save, post_delete], sender=IngredientForRecipe)
+def refresh_ingredient_ids(sender, instance, **kwargs):
+    # save() рецепта записывает и старый массив из памяти, поэтому он
+    # пересчитывается после каждого сохранения. Строки по одной пишет
+    # админка; после bulk_create сериализатор пересчитывает массив сам.
+    update_ingredient_ids(
+        instance.pk if sender is Recipe else instance.recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(pre_delete, sender=Recipe)
+def invalidate_recipe_page_cache(sender, instance, **kwargs):
+    invalidate_recipe_pages(
+        instance.pk, instance.author_id, recipe_tag_slugs(instance.pk))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_tag_page_cache(sender, instance, action, reverse, pk_set,
+                              **kwargs):
+    if reverse or action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    invalidate_recipe_pages(
+        instance.pk, instance.author_id,
+        recipe_tag_slugs(instance.pk, pk_set),
+    )
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Follow)
+def invalidate_user_relations(sender, instance, **kwargs):
+    user_id = instance.user_id
+    invalidate_relations(user_id)
+    # Повторно после коммита: post_delete приходит внутри транзакции
+    # удаления, и параллельный запрос успел бы закэшировать старые id.
+    transaction.on_commit(lambda: invalidate_relations(user_id))
+
+
+@receiver(post_save, sender=Favorite)
+def increment_favorites_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def decrement_favorites_count(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(CustomUser, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    change_counter(CustomUser, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def increment_followers_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(CustomUser, instance.author_id, 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_followers_count(sender, instance, **kwargs):
+    change_counter(CustomUser, instance.author_id, 'followers_count', -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_cart_totals(sender, instance, created, **kwargs):
+    if created:
+        cart_totals.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def subtract_cart_totals(sender, instance, **kwargs):
+    # pre_delete: при каскадном удалении рецепта его ингредиенты ещё есть.
+    cart_totals.remove_recipe(instance.user_id, instance.recipe_id)
+
+
+def invalidate_follower_feeds(author_id):
+    follower_ids = list(Follow.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True))
+    # После коммита, чтобы первая страница не закэшировалась без рецепта.
+    transaction.on_commit(lambda: invalidate_feeds(follower_ids))
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_feeds_on_publish(sender, instance, created, **kwargs):
+    if created:
+        invalidate_follower_feeds(instance.author_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_feeds_on_delete(sender, instance, **kwargs):
+    invalidate_follower_feeds(instance.author_id)
+
+
+@receiver([post_save, post_delete], sender=Follow)
+def invalidate_own_feed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_feeds([instance.user_id]))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def record_recipe_change(sender, instance, **kwargs):
+    # После коммита: состав рецепта пишется в той же транзакции. pk
+    # берётся сейчас: к коммиту удаление уже обнулит instance.pk.
+    pk = instance.pk
+    transaction.on_commit(lambda: record_change(pk))
+
+
+@receiver([post_save, post_delete], sender=IngredientForRecipe)
+def record_composition_change(sender, instance, **kwargs):
+    # Строки, изменённые через bulk_create/bulk_update в сериализаторе,
+    # сигналов не шлют; их покрывает сохранение самого рецепта.
+    transaction.on_commit(lambda: record_change(instance.recipe_id))
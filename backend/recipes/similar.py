@@ -0,0 +1,406 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import groupby, repeat
+from operator import mul
+
+from django.conf import settings
+
+from .changes import changed_since, log_id, log_version
+from .models import IngredientForRecipe
+
+MAGIC = b'FGSIMILAR1\n'
+HEADER = struct.Struct('<Q')
+ALIGNMENT = 8
+# Разреженная матрица рецепт x ингредиент в двух видах: по строкам
+# (вектор рецепта) и по столбцам (рецепты с ингредиентом).
+ARRAYS = (
+    ('recipe_ids', 'q'), ('row_ptr', 'q'), ('row_cols', 'i'),
+    ('row_vals', 'f'), ('ingredient_ids', 'q'), ('idf', 'f'),
+    ('col_ptr', 'q'), ('col_rows', 'i'), ('col_vals', 'f'),
+)
+
+
+def smooth_idf(recipes, frequency):
+    return math.log((1 + recipes) / (1 + frequency)) + 1
+
+
+def normalize(weights):
+    """{ингредиент: вес} с единичной евклидовой нормой."""
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    return {key: weight / norm for key, weight in weights.items()}
+
+
+def pad(size):
+    return -size % ALIGNMENT
+
+
+class SimilarityMatrix:
+    """TF-IDF векторы рецептов по составу в плоских массивах.
+
+    Вес ингредиента в рецепте — сглаженный IDF (TF бинарный: важен
+    факт наличия, а не количество в разных единицах), строки
+    нормированы, поэтому косинус — это скалярное произведение.
+    Массивы сохраняются одним файлом и открываются через mmap без
+    копирования, так что воркеры делят одну копию в page cache ОС.
+    """
+
+    def __init__(self, arrays, version=0, buffer=None, log=None):
+        for name, _ in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.version = version
+        self.log = log
+        self._buffer = buffer
+
+    @classmethod
+    def build(cls, pairs, version=0, log=None):
+        """Матрица из пар (id рецепта, id ингредиента), упорядоченных
+        по рецепту."""
+        rows = [
+            (recipe_id, sorted({ingredient for _, ingredient in group}))
+            for recipe_id, group in groupby(pairs, key=lambda pair: pair[0])
+        ]
+        rows.sort()
+        frequency = {}
+        for _, ingredients in rows:
+            for ingredient in ingredients:
+                frequency[ingredient] = frequency.get(ingredient, 0) + 1
+        ingredient_ids = sorted(frequency)
+        columns = {id_: col for col, id_ in enumerate(ingredient_ids)}
+        idf = [smooth_idf(len(rows), frequency[id_]) for id_ in ingredient_ids]
+
+        arrays = {name: array(typecode) for name, typecode in ARRAYS}
+        arrays['row_ptr'].append(0)
+        for recipe_id, ingredients in rows:
+            vector = normalize({
+                columns[id_]: idf[columns[id_]] for id_ in ingredients})
+            arrays['recipe_ids'].append(recipe_id)
+            arrays['row_cols'].extend(vector)
+            arrays['row_vals'].extend(vector.values())
+            arrays['row_ptr'].append(len(arrays['row_cols']))
+        arrays['ingredient_ids'].extend(ingredient_ids)
+        arrays['idf'].extend(idf)
+
+        # Списки столбцов упорядочены по убыванию веса: top_rows
+        # обрывает их, когда остаток уже не влияет на результат.
+        postings = [[] for _ in ingredient_ids]
+        row_ptr = arrays['row_ptr']
+        for row in range(len(rows)):
+            for position in range(row_ptr[row], row_ptr[row + 1]):
+                postings[arrays['row_cols'][position]].append(
+                    (-arrays['row_vals'][position], row))
+        arrays['col_ptr'].append(0)
+        for column in postings:
+            column.sort()
+            arrays['col_rows'].extend(row for _, row in column)
+            arrays['col_vals'].extend(-value for value, _ in column)
+            arrays['col_ptr'].append(len(arrays['col_rows']))
+        return cls(arrays, version, log=log)
+
+    @classmethod
+    def from_database(cls):
+        log, version = log_id(), log_version()
+        pairs = IngredientForRecipe.objects.order_by(
+            'recipe_id').values_list('recipe_id', 'ingredient_id')
+        return cls.build(pairs.iterator(chunk_size=10000), version, log)
+
+    def save(self, path):
+        """Пишет матрицу во временный файл и атомарно подменяет path."""
+        header = json.dumps({
+            'version': self.version,
+            'log': self.log,
+            'byteorder': sys.byteorder,
+            'arrays': [
+                [name, typecode, len(getattr(self, name))]
+                for name, typecode in ARRAYS
+            ],
+        }).encode()
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(MAGIC + HEADER.pack(len(header)) + header)
+            file.write(b'\0' * pad(file.tell()))
+            for name, _ in ARRAYS:
+                data = getattr(self, name)
+                if not isinstance(data, array):
+                    data = data.tobytes()
+                file.write(data)
+                file.write(b'\0' * pad(file.tell()))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """Открывает сохранённую матрицу; None, если файл не подходит."""
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+        offset = len(MAGIC) + HEADER.size
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            return None
+        (size,) = HEADER.unpack(view[len(MAGIC):offset])
+        header = json.loads(bytes(view[offset:offset + size]))
+        if header['byteorder'] != sys.byteorder:
+            return None
+        offset += size
+        offset += pad(offset)
+        arrays = {}
+        for name, typecode, length in header['arrays']:
+            nbytes = length * array(typecode).itemsize
+            arrays[name] = view[offset:offset + nbytes].cast(typecode)
+            offset += nbytes + pad(nbytes)
+        return cls(arrays, header['version'], buffer, header.get('log'))
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def row_of(self, recipe_id):
+        row = bisect_left(self.recipe_ids, recipe_id)
+        if row < len(self.recipe_ids) and self.recipe_ids[row] == recipe_id:
+            return row
+        return None
+
+    def column_of(self, ingredient_id):
+        col = bisect_left(self.ingredient_ids, ingredient_id)
+        if (col < len(self.ingredient_ids)
+                and self.ingredient_ids[col] == ingredient_id):
+            return col
+        return None
+
+    def vector(self, row):
+        """{id ингредиента: вес} строки матрицы."""
+        start, end = self.row_ptr[row], self.row_ptr[row + 1]
+        return {
+            self.ingredient_ids[col]: value for col, value in zip(
+                self.row_cols[start:end], self.row_vals[start:end])
+        }
+
+    def weigh(self, ingredient_ids):
+        """TF-IDF вектор нового состава по IDF матрицы.
+
+        Ингредиент, которого в матрице нет, считается встреченным один раз.
+        """
+        weights = {}
+        for id_ in set(ingredient_ids):
+            col = self.column_of(id_)
+            weights[id_] = (
+                smooth_idf(len(self), 1) if col is None else self.idf[col])
+        return normalize(weights) if weights else {}
+
+    def top_rows(self, vector, k, exclude=frozenset()):
+        """[(косинус, строка)] k строк, ближайших к vector.
+
+        Списки столбцов обходятся от коротких (редкие ингредиенты) к
+        длинным, каждый — по убыванию веса. Список обрывается, как только
+        непросмотренная строка не может набрать больше k-й найденной
+        оценки даже с максимумами оставшихся списков (MaxScore).
+        Оборванные вклады кандидатов досчитываются по их строкам.
+        """
+        col_ptr, col_rows, col_vals = (
+            self.col_ptr, self.col_rows, self.col_vals)
+        columns = (
+            (self.column_of(id_), weight) for id_, weight in vector.items())
+        terms = sorted(
+            (col_ptr[col + 1] - col_ptr[col], col, weight)
+            for col, weight in columns if col is not None
+        )
+        rest = [0.0] * (len(terms) + 1)
+        for number in range(len(terms) - 1, -1, -1):
+            _, col, weight = terms[number]
+            rest[number] = rest[number + 1] + weight * col_vals[col_ptr[col]]
+
+        weights = {col: weight for _, col, weight in terms}
+        scores = {}
+        get = scores.get
+        kth = 0.0
+        missed = 0.0
+        # Строк среди k + len(exclude) лучших хватает на k неисключённых,
+        # так что эта оценка — нижняя граница k-й.
+        depth = k + len(exclude)
+        for number, (length, col, weight) in enumerate(terms):
+            if length > len(scores) >= depth:
+                kth = heapq.nlargest(depth, scores.values())[-1]
+            start, end = col_ptr[col], col_ptr[col + 1]
+            if kth:
+                minimum = (kth - missed - rest[number + 1]) / weight
+                end = self.cut(start, end, minimum)
+            for row, value in zip(col_rows[start:end], col_vals[start:end]):
+                scores[row] = get(row, 0.0) + weight * value
+            if end < col_ptr[col + 1]:
+                missed += weight * col_vals[end]
+
+        candidates = sorted((
+            (score, row) for row, score in scores.items()
+            if row not in exclude
+        ), reverse=True)
+        if not missed:
+            return heapq.nlargest(
+                k, candidates,
+                key=lambda candidate: (candidate[0], -candidate[1]))
+        return self.refine(candidates, weights, missed, k)
+
+    def refine(self, candidates, weights, missed, k):
+        """Точные оценки кандидатов, которым не хватает вкладов оборванных
+        списков; candidates упорядочены по убыванию частичной оценки."""
+        best = []
+        for score, row in candidates:
+            if len(best) == k and score + missed < best[0][0]:
+                break
+            item = (self.dot(row, weights), -row)
+            if len(best) < k:
+                heapq.heappush(best, item)
+            else:
+                heapq.heappushpop(best, item)
+        return [(score, -row) for score, row in sorted(best, reverse=True)]
+
+    def cut(self, start, end, minimum):
+        """Первая позиция списка столбца с весом меньше minimum."""
+        values = self.col_vals
+        while start < end:
+            middle = (start + end) // 2
+            if values[middle] < minimum:
+                end = middle
+            else:
+                start = middle + 1
+        return start
+
+    def dot(self, row, weights):
+        """Скалярное произведение строки на {столбец: вес}."""
+        start, end = self.row_ptr[row], self.row_ptr[row + 1]
+        return sum(map(
+            mul, self.row_vals[start:end],
+            map(weights.get, self.row_cols[start:end], repeat(0.0)),
+        ))
+
+
+def file_identity(path):
+    """(inode, mtime, размер) файла или None, если его нет."""
+    try:
+        stat = os.stat(path) if path else None
+    except OSError:
+        return None
+    return stat and (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class SimilarRecipes:
+    """Ближайшие по составу рецепты из матрицы в памяти процесса.
+
+    Матрица открывается из файла build_similar_index или строится по
+    базе; новый файл (другие inode, mtime или размер) открывается
+    заново. Изменённые после сборки рецепты приходят через журнал в
+    кэше и хранятся поверх матрицы, пока их не больше
+    SIMILAR_OVERLAY_LIMIT; дальше или при потерянном журнале матрица
+    строится заново. Файл, собранный с другим журналом (кэш в памяти
+    процесса команды или сброшенный Redis), не знает, какие изменения
+    пропустил, поэтому вместо него матрица строится по базе.
+    """
+
+    def __init__(self):
+        self._matrix = None
+        self._file = None
+        self._overlay = {}
+        self._stale_rows = frozenset()
+        self._lock = threading.Lock()
+
+    def _load(self, identity):
+        matrix = None
+        if identity is not None:
+            matrix = SimilarityMatrix.load(settings.SIMILAR_INDEX_PATH)
+        if matrix is None or matrix.log != log_id():
+            return SimilarityMatrix.from_database()
+        return matrix
+
+    def _ensure_current(self):
+        version = log_version()
+        identity = file_identity(settings.SIMILAR_INDEX_PATH)
+        matrix = self._matrix
+        if (matrix is not None and version == matrix.version
+                and identity == self._file):
+            return
+        with self._lock:
+            if self._matrix is None or identity != self._file:
+                self._set(self._load(identity))
+                self._file = identity
+            matrix = self._matrix
+            if version == matrix.version:
+                return
+            changed = changed_since(matrix.version, version)
+            if (changed is None or len(self._overlay.keys() | changed)
+                    > settings.SIMILAR_OVERLAY_LIMIT):
+                self._set(SimilarityMatrix.from_database())
+                return
+            overlay = dict(self._overlay)
+            overlay.update(self._vectors(matrix, changed))
+            self._set(matrix, overlay)
+            matrix.version = version
+
+    def _set(self, matrix, overlay=None):
+        overlay = overlay or {}
+        self._stale_rows = frozenset(
+            row for row in map(matrix.row_of, overlay) if row is not None)
+        self._matrix, self._overlay = matrix, overlay
+
+    def _vectors(self, matrix, recipe_ids):
+        """Новые векторы рецептов; None для удалённых и пустых."""
+        compositions = {id_: [] for id_ in recipe_ids}
+        for recipe_id, ingredient_id in IngredientForRecipe.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient_id'):
+            compositions[recipe_id].append(ingredient_id)
+        return {
+            id_: matrix.weigh(ingredients) or None
+            for id_, ingredients in compositions.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._matrix, self._file, self._overlay = None, None, {}
+            self._stale_rows = frozenset()
+
+    def top_k(self, recipe_id, k):
+        """[(id рецепта, косинус)] k самых похожих, без самого рецепта."""
+        self._ensure_current()
+        matrix, overlay = self._matrix, self._overlay
+        if recipe_id in overlay:
+            vector = overlay[recipe_id]
+        else:
+            row = matrix.row_of(recipe_id)
+            vector = None if row is None else matrix.vector(row)
+        if not vector:
+            return []
+        return nearest(
+            matrix, recipe_id, vector, k, overlay, self._stale_rows)
+
+
+def nearest(matrix, recipe_id, vector, k, overlay=None,
+            stale_rows=frozenset()):
+    """Ближайшие к vector рецепты матрицы и изменённые поверх неё.
+
+    Строки изменённых рецептов (stale_rows) устарели и пропускаются.
+    """
+    exclude = set(stale_rows)
+    row = matrix.row_of(recipe_id)
+    if row is not None:
+        exclude.add(row)
+    candidates = [
+        (score, matrix.recipe_ids[row])
+        for score, row in matrix.top_rows(vector, k, exclude)
+    ]
+    for id_, other in (overlay or {}).items():
+        if other and id_ != recipe_id:
+            score = sum(
+                weight * other.get(ingredient, 0.0)
+                for ingredient, weight in vector.items())
+            if score > 0:
+                candidates.append((score, id_))
+    best = heapq.nlargest(
+        k, candidates, key=lambda candidate: (candidate[0], -candidate[1]))
+    return [(id_, round(score, 6)) for score, id_ in best]
+
+
+similar_recipes = SimilarRecipes()
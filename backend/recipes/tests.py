@@ -0,0 +1,1372 @@
+import base64
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from itertools import product
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import (AsyncClient, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import CustomUser, Follow
+
+from .autocomplete import ingredient_index
+from .batch import FavoriteBatch, ShoppingCartBatch
+from .cart_totals import live_totals
+from .changes import log_id, log_version
+from .feed import feed_key, feed_positions
+from .filters import tag_choices
+from .models import (CartIngredientTotal, Favorite, Ingredient,
+                     IngredientForRecipe, Recipe, ShoppingCart, Tag)
+from .page_cache import PageCache
+from .pantry import PantryIndex, pantry_index
+from .search import recipe_search_index
+from .shopping_list import UNITS, humanize_amount, normalize_amounts
+from .similar import SimilarityMatrix, SimilarRecipes, similar_recipes
+
+# Тесты очищают кэш, поэтому работают с кэшем в памяти процесса, а не
+# с общим Redis из REDIS_URL.
+TEST_CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'tests-{alias}',
+    }
+    for alias in ('default', 'pages')
+}
+
+
+def create_user(name):
+    return CustomUser.objects.create_user(
+        email=f'{name}@example.com', username=name,
+        first_name=name, last_name=name, password='pass-word-123',
+    )
+
+
+def client_for(user):
+    client = APIClient()
+    token, _ = Token.objects.get_or_create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+def stored_totals(user):
+    return dict(CartIngredientTotal.objects.filter(
+        user=user, amount__gt=0).values_list('ingredient_id', 'amount'))
+
+
+def actual_totals(user):
+    return {
+        row['ingredient_id']: row['amount']
+        for row in live_totals([user.pk])
+    }
+
+
+def clear_caches():
+    for alias in ('default', 'pages'):
+        caches[alias].clear()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShoppingListTests(TestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(5)
+        ]
+        cls.recipes = []
+        for number in range(10):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', image='a.png',
+                text='Описание', cooking_time=10,
+            )
+            IngredientForRecipe.objects.bulk_create([
+                IngredientForRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=10)
+                for ingredient in cls.ingredients[:number % 5 + 1]
+            ])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        clear_caches()
+
+    def download(self, cart_size, queries):
+        user = create_user(f'buyer{cart_size}')
+        for recipe in self.recipes[:cart_size]:
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+        client = client_for(user)
+        # Токен, три запроса связей пользователя и один запрос итогов.
+        with self.assertNumQueries(queries):
+            response = client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            return b''.join(response.streaming_content).decode()
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        small = self.download(2, 5)
+        large = self.download(10, 5)
+        self.assertIn('Ингредиент 0 - 20 г', small)
+        self.assertIn('Ингредиент 1 - 10 г', small)
+        self.assertNotIn('Ингредиент 2', small)
+        self.assertIn('Ингредиент 0 - 100 г', large)
+        self.assertIn('Ингредиент 4 - 20 г', large)
+
+    def buyer_client(self):
+        self.buyer = create_user('buyer')
+        for recipe in self.recipes[:2]:
+            ShoppingCart.objects.create(user=self.buyer, recipe=recipe)
+        return client_for(self.buyer)
+
+    def test_formats(self):
+        client = self.buyer_client()
+        expected = {
+            'txt': 'text/plain; charset=utf-8',
+            'csv': 'text/csv; charset=utf-8',
+            'json': 'application/json',
+            'pdf': 'application/pdf',
+        }
+        contents = {}
+        for export_format, content_type in expected.items():
+            response = client.get(self.url, {'format': export_format})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], content_type)
+            self.assertIn(
+                f'wishlist.{export_format}', response['Content-Disposition'])
+            contents[export_format] = b''.join(response.streaming_content)
+        self.assertIn(
+            'Ингредиент 0,20,г', contents['csv'].decode().splitlines())
+        self.assertIn(
+            {'name': 'Ингредиент 1', 'amount': 10, 'measurement_unit': 'г'},
+            json.loads(contents['json']))
+        # Кириллица выводится встроенным TrueType-шрифтом.
+        self.assertTrue(contents['pdf'].startswith(b'%PDF'))
+        self.assertIn(b'/FontFile2', contents['pdf'])
+        self.assertIn(b'DejaVuSans', contents['pdf'])
+
+    def test_unknown_format_is_rejected(self):
+        response = self.buyer_client().get(self.url, {'format': 'docx'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pdf', response.json()['message'])
+
+    def test_unchanged_cart_is_not_modified(self):
+        client = self.buyer_client()
+        response = client.get(self.url, {'format': 'pdf'})
+        etag = response['ETag']
+        b''.join(response.streaming_content)
+        response = client.get(
+            self.url, {'format': 'pdf'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # Другой формат того же списка — другой файл.
+        response = client.get(
+            self.url, {'format': 'txt'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        ShoppingCart.objects.create(user=self.buyer, recipe=self.recipes[2])
+        response = client.get(
+            self.url, {'format': 'pdf'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeFilterTests(TestCase):
+    """Все сочетания tags, author, is_favorited и is_in_shopping_cart
+    для анонимного и авторизованного пользователя."""
+
+    TAGS = ([], ['breakfast'], ['breakfast', 'lunch'])
+    FLAGS = (None, '1', '0')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.other = create_user('writer')
+        tags = {
+            slug: Tag.objects.create(name=slug, color='#ffffff', slug=slug)
+            for slug in ('breakfast', 'lunch', 'dinner')
+        }
+        layout = [
+            (cls.user, ['breakfast', 'lunch'], True, True),
+            (cls.other, ['breakfast'], True, False),
+            (cls.other, ['lunch'], False, True),
+            (cls.user, ['dinner'], False, False),
+            (cls.other, ['breakfast', 'lunch', 'dinner'], True, True),
+            (cls.other, [], False, False),
+        ]
+        cls.recipes = []
+        for number, (author, slugs, favorite, in_cart) in enumerate(layout):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', image='a.png',
+                text='Описание', cooking_time=10,
+            )
+            recipe.tags.set([tags[slug] for slug in slugs])
+            if favorite:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if in_cart:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+            cls.recipes.append((recipe.pk, author, set(slugs), favorite,
+                                in_cart))
+
+    def setUp(self):
+        clear_caches()
+
+    def expected_ids(self, tags, author, favorited, in_cart, authenticated):
+        ids = set()
+        for pk, recipe_author, slugs, favorite, cart in self.recipes:
+            if tags and not slugs & set(tags):
+                continue
+            if author is not None and recipe_author != author:
+                continue
+            if favorited == '1' and not (authenticated and favorite):
+                continue
+            if in_cart == '1' and not (authenticated and cart):
+                continue
+            ids.add(pk)
+        return ids
+
+    def expected_queries(self, authenticated, user_filter, empty):
+        if user_filter and not authenticated:
+            # queryset.none(): ни COUNT, ни выборки страницы.
+            return 0
+        # Токен, COUNT и страница, затем три prefetch для рецептов.
+        return int(authenticated) + 2 + (0 if empty else 3)
+
+    def check_combinations(self, client, authenticated):
+        # Кэширует связи пользователя и варианты тегов.
+        client.get('/api/recipes/', {'tags': 'dinner'})
+        authors = (None, self.user, self.other)
+        for tags, author, favorited, in_cart in product(
+                self.TAGS, authors, self.FLAGS, self.FLAGS):
+            params = {'limit': 100, 'tags': tags}
+            if author is not None:
+                params['author'] = author.pk
+            if favorited is not None:
+                params['is_favorited'] = favorited
+            if in_cart is not None:
+                params['is_in_shopping_cart'] = in_cart
+            expected = self.expected_ids(
+                tags, author, favorited, in_cart, authenticated)
+            queries = self.expected_queries(
+                authenticated, '1' in (favorited, in_cart), not expected)
+            with self.subTest(**params):
+                with self.assertNumQueries(queries):
+                    response = client.get('/api/recipes/', params)
+                self.assertEqual(response.status_code, 200)
+                data = response.json()
+                ids = [recipe['id'] for recipe in data['results']]
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertEqual(set(ids), expected)
+                self.assertEqual(data['count'], len(expected))
+
+    def test_anonymous(self):
+        self.check_combinations(APIClient(), authenticated=False)
+
+    def test_authenticated(self):
+        self.check_combinations(client_for(self.user), authenticated=True)
+
+    def test_flags_for_authenticated_user(self):
+        response = client_for(self.user).get(
+            '/api/recipes/', {'limit': 100})
+        flags = {
+            recipe['id']: (
+                recipe['is_favorited'], recipe['is_in_shopping_cart'])
+            for recipe in response.json()['results']
+        }
+        self.assertEqual(flags, {
+            pk: (favorite, cart)
+            for pk, _, _, favorite, cart in self.recipes
+        })
+
+    def test_unknown_tag_is_rejected(self):
+        response = APIClient().get('/api/recipes/', {'tags': 'brunch'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES, IMAGE_VARIANTS_ASYNC=False)
+class SearchTests(TestCase):
+    """?search= ранжирует совпадения в названии выше совпадений в
+    описании, ?ingredients= оставляет рецепты со всеми ингредиентами."""
+
+    url = '/api/recipes/'
+
+    def setUp(self):
+        clear_caches()
+        recipe_search_index.reset()
+        pantry_index.reset()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.client = client_for(create_user('cook'))
+        self.tag = Tag.objects.create(
+            name='Обед', color='#ffffff', slug='lunch')
+        self.beet, self.pea, self.salt = [
+            Ingredient.objects.create(name=name, measurement_unit='г').pk
+            for name in ('Свёкла', 'Горох', 'Соль')
+        ]
+        self.borscht = self.create(
+            'Борщ', 'Суп со свёклой', [self.beet, self.salt])
+        self.pea_soup = self.create(
+            'Суп гороховый', 'Густой', [self.pea, self.salt])
+        self.salad = self.create('Салат', 'Свёкла и соль', [self.beet])
+
+    def create(self, name, text, ingredients):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {
+                'name': name, 'text': text, 'cooking_time': 5,
+                'tags': [self.tag.pk], 'image': image_data(),
+                'ingredients': [
+                    {'id': id_, 'amount': 10} for id_ in ingredients],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def ids(self, **params):
+        response = APIClient().get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_search_ranks_name_above_text(self):
+        found = self.ids(search='суп')
+        self.assertEqual(found[0], self.pea_soup)
+        self.assertEqual(set(found), {self.pea_soup, self.borscht})
+        self.assertEqual(self.ids(search='суп свёклой'), [self.borscht])
+        self.assertEqual(self.ids(search='пицца'), [])
+
+    def test_ingredients_require_all(self):
+        self.assertEqual(
+            set(self.ids(ingredients=f'{self.beet}')),
+            {self.borscht, self.salad})
+        self.assertEqual(
+            self.ids(ingredients=f'{self.beet},{self.salt}'), [self.borscht])
+        self.assertEqual(
+            self.ids(ingredients=f'{self.beet},{self.pea}'), [])
+        self.assertEqual(
+            self.ids(ingredients=f'{self.salt}', search='суп'),
+            [self.pea_soup, self.borscht])
+
+    def test_edits_are_indexed_without_rebuild(self):
+        self.ids(search='суп', ingredients=f'{self.salt}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'{self.url}{self.salad}/', {
+                'name': 'Суп-салат', 'text': 'Холодный',
+                'tags': [self.tag.pk],
+                'ingredients': [
+                    {'id': self.beet, 'amount': 10},
+                    {'id': self.salt, 'amount': 5},
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        with mock.patch.object(
+                recipe_search_index, '_build',
+                side_effect=AssertionError('полная пересборка')):
+            self.assertEqual(
+                set(self.ids(search='суп')),
+                {self.pea_soup, self.borscht, self.salad})
+            self.assertEqual(self.ids(search='соль'), [])
+            self.assertEqual(self.ids(search='холодный'), [self.salad])
+        self.assertEqual(
+            set(self.ids(ingredients=f'{self.beet},{self.salt}')),
+            {self.borscht, self.salad})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PageCacheTests(TestCase):
+    """Сохранение рецепта сбрасывает только страницы его автора, тегов и
+    общей ленты; страницу, которую пересчитывает другой процесс, отдают
+    из прошлой копии."""
+
+    url = '/api/recipes/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = create_user('first')
+        cls.second = create_user('second')
+        tags = {
+            slug: Tag.objects.create(name=slug, color='#ffffff', slug=slug)
+            for slug in ('breakfast', 'lunch')
+        }
+        cls.recipe = Recipe.objects.create(
+            author=cls.first, name='Каша', image='a.png', text='Описание',
+            cooking_time=10,
+        )
+        cls.recipe.tags.set([tags['breakfast']])
+        cls.other = Recipe.objects.create(
+            author=cls.second, name='Суп', image='a.png', text='Описание',
+            cooking_time=10,
+        )
+        cls.other.tags.set([tags['lunch']])
+
+    def setUp(self):
+        clear_caches()
+
+    def get(self, path, params=None):
+        """(названия рецептов, ответ взят из кэша)."""
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(path, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        results = data['results'] if 'results' in data else [data]
+        return [recipe['name'] for recipe in results], not queries
+
+    def rename(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = name
+            self.recipe.save()
+
+    def test_save_invalidates_only_affected_pages(self):
+        pages = {
+            'first': (self.url, {'author': self.first.pk}),
+            'breakfast': (self.url, {'tags': 'breakfast'}),
+            'all': (self.url, {}),
+            'detail': (f'{self.url}{self.recipe.pk}/', None),
+            'second': (self.url, {'author': self.second.pk}),
+            'lunch': (self.url, {'tags': 'lunch'}),
+            'other': (f'{self.url}{self.other.pk}/', None),
+        }
+        for path, params in pages.values():
+            self.get(path, params)
+        self.rename('Омлет')
+        for page in ('first', 'breakfast', 'all', 'detail'):
+            names, cached = self.get(*pages[page])
+            self.assertFalse(cached, page)
+            self.assertIn('Омлет', names)
+        for page in ('second', 'lunch', 'other'):
+            names, cached = self.get(*pages[page])
+            self.assertTrue(cached, page)
+            self.assertEqual(names, ['Суп'])
+
+    def test_page_being_computed_is_served_from_previous_copy(self):
+        params = {'tags': 'breakfast'}
+        self.get(self.url, params)
+        self.rename('Омлет')
+        with mock.patch.object(PageCache, 'acquire', return_value=False):
+            with mock.patch('recipes.page_cache.time.sleep') as sleep:
+                self.assertEqual(
+                    self.get(self.url, params), (['Каша'], True))
+        sleep.assert_not_called()
+        self.assertEqual(self.get(self.url, params), (['Омлет'], False))
+
+    def test_page_without_copy_is_computed_after_short_wait(self):
+        self.assertLess(PageCache.wait_timeout, 1)
+        with mock.patch.object(PageCache, 'acquire', return_value=False):
+            with mock.patch.object(PageCache, 'wait_timeout', 0.05):
+                names, cached = self.get(self.url, {'tags': 'breakfast'})
+        self.assertEqual((names, cached), (['Каша'], False))
+        self.assertEqual(
+            self.get(self.url, {'tags': 'breakfast'}), (['Каша'], True))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PantryTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+
+    def test_equal_coverage_is_ordered_newest_first(self):
+        # 2 и 4 — доля 1/1, 1 и 3 — доля 1/2: размеры разные, но внутри
+        # равной доли порядок только по новизне.
+        index = PantryIndex([
+            (1, 10), (1, 11), (2, 10), (3, 10), (3, 12),
+            (4, 10), (4, 11),
+        ])
+        self.assertEqual(
+            index.match([10, 11], 3),
+            [(4, 1.0, 0), (2, 1.0, 0), (1, 1.0, 0)])
+        self.assertEqual(index.match([10, 11], 1), [(4, 1.0, 0)])
+        self.assertEqual(index.match([10], 2), [(2, 1.0, 0), (4, 0.5, 1)])
+
+    def test_images_are_absolute(self):
+        author = create_user('cook')
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', image='a.png', text='Описание',
+            cooking_time=10,
+        )
+        IngredientForRecipe.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=1)
+        pantry_index.reset()
+        response = APIClient().get(
+            '/api/recipes/pantry/', {'ingredients': ingredient.pk})
+        self.assertEqual(response.status_code, 200)
+        image = response.json()['results'][0]['image']
+        self.assertTrue(image.startswith('http://testserver/'), image)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SimilarRecipesTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'similar.idx')
+
+    def save(self, pairs, log=None):
+        matrix = SimilarityMatrix.build(
+            pairs, log_version(), log or log_id())
+        matrix.save(self.path)
+
+    def test_rebuilt_file_is_reopened(self):
+        similar = SimilarRecipes()
+        with self.settings(SIMILAR_INDEX_PATH=self.path):
+            self.save([(1, 10), (2, 10), (3, 11)])
+            self.assertEqual(similar.top_k(1, 5), [(2, 1.0)])
+            self.save([(1, 11), (2, 10), (3, 11)])
+            self.assertEqual(similar.top_k(1, 5), [(3, 1.0)])
+
+    def test_file_from_another_log_is_not_trusted(self):
+        author = create_user('cook')
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+        ids = []
+        for number in range(2):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', image='a.png',
+                text='Описание', cooking_time=10,
+            )
+            IngredientForRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=1)
+            ids.append(recipe.pk)
+        with self.settings(SIMILAR_INDEX_PATH=self.path):
+            self.save([(ids[0], 1)], log='other')
+            self.assertEqual(
+                SimilarRecipes().top_k(ids[0], 5), [(ids[1], 1.0)])
+            response = APIClient().get(f'/api/recipes/{ids[0]}/similar/')
+        self.assertEqual(response.status_code, 200)
+        image = response.json()[0]['image']
+        self.assertTrue(image.startswith('http://testserver/'), image)
+
+
+def image_data(size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+@override_settings(CACHES=TEST_CACHES, IMAGE_VARIANTS_ASYNC=False)
+class RecipeImageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('painter')
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#ffffff', slug='lunch')
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+
+    def setUp(self):
+        clear_caches()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.client = client_for(self.author)
+
+    def create(self, image):
+        return self.client.post('/api/recipes/', {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 5,
+            'tags': [self.tag.pk], 'image': image,
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 10}],
+        }, format='json')
+
+    @override_settings(RECIPE_IMAGE_MAX_SIZE=100)
+    def test_large_image_is_rejected(self):
+        response = self.create(image_data((200, 200)))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.json())
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_variant_urls_are_served_without_storage_lookups(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.create(image_data())
+        self.assertEqual(response.status_code, 201)
+        original = response.json()['image']
+        self.assertEqual(
+            set(response.json()['image_variants'].values()), {original})
+
+        for callback in callbacks:
+            callback()
+        recipe = Recipe.objects.get()
+        self.assertEqual(recipe.image_variants_name, recipe.image.name)
+        with mock.patch.object(
+                FileSystemStorage, 'exists',
+                side_effect=AssertionError('exists() при выдаче')):
+            response = APIClient().get('/api/recipes/')
+        variants = response.json()['results'][0]['image_variants']
+        self.assertEqual(set(variants), {'thumbnail', 'medium'})
+        for variant, url in variants.items():
+            self.assertTrue(url.startswith('http://testserver/'), url)
+            self.assertIn(f'_{variant}.', url)
+            path = url.replace('http://testserver/backend_media/', '')
+            self.assertTrue(FileSystemStorage().exists(path), path)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BatchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('batcher')
+        cls.author = create_user('chef')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {number}', measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.recipes = []
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', image='a.png',
+                text='Описание', cooking_time=10,
+            )
+            IngredientForRecipe.objects.bulk_create([
+                IngredientForRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1)
+                for ingredient in cls.ingredients[:number + 1]
+            ])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        clear_caches()
+        self.client = client_for(self.user)
+
+    def statuses(self, response):
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item['status'] for item in response.json()}
+
+    def test_partial_favorite_results_and_counters(self):
+        first, second, _ = self.recipes
+        Favorite.objects.create(user=self.user, recipe=first)
+        response = self.client.post('/api/recipes/favorite/', {
+            'ids': [first.pk, second.pk, 999999]}, format='json')
+        self.assertEqual(self.statuses(response), {
+            first.pk: '400', second.pk: '201', 999999: '404'})
+        self.assertEqual(
+            Recipe.objects.get(pk=second.pk).favorites_count, 1)
+        self.assertEqual(
+            Recipe.objects.get(pk=first.pk).favorites_count, 1)
+
+        response = self.client.delete(
+            f'/api/recipes/favorite/?ids={second.pk},{self.recipes[2].pk}')
+        self.assertEqual(self.statuses(response), {
+            second.pk: '204', self.recipes[2].pk: '400'})
+        self.assertEqual(
+            Recipe.objects.get(pk=second.pk).favorites_count, 0)
+
+    def test_invalid_ids_are_rejected(self):
+        response = self.client.post(
+            '/api/recipes/favorite/', {'ids': ['1']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_self_follow_is_rejected(self):
+        response = self.client.post('/api/users/subscribe/', {
+            'ids': [self.user.pk, self.author.pk]}, format='json')
+        self.assertEqual(self.statuses(response), {
+            self.user.pk: '400', self.author.pk: '201'})
+        self.assertEqual(
+            CustomUser.objects.get(pk=self.author.pk).followers_count, 1)
+        self.assertEqual(
+            CustomUser.objects.get(pk=self.user.pk).followers_count, 0)
+        self.assertFalse(
+            Follow.objects.filter(user=self.user, author=self.user).exists())
+
+    def test_cart_totals_follow_batch(self):
+        ids = [recipe.pk for recipe in self.recipes]
+        response = self.client.post(
+            '/api/recipes/shopping_cart/', {'ids': ids}, format='json')
+        self.assertEqual(set(self.statuses(response).values()), {'201'})
+        self.assertEqual(stored_totals(self.user), actual_totals(self.user))
+        self.assertEqual(
+            stored_totals(self.user)[self.ingredients[0].pk], 6)
+        self.client.delete(f'/api/recipes/shopping_cart/?ids={ids[2]}')
+        self.assertEqual(stored_totals(self.user), actual_totals(self.user))
+
+    def test_rows_inserted_concurrently_are_not_counted_twice(self):
+        first, second, _ = self.recipes
+        # Параллельный запрос вставил строку после проверки existing.
+        Favorite.objects.create(user=self.user, recipe=first)
+        ShoppingCart.objects.create(user=self.user, recipe=first)
+        for batch_class in (FavoriteBatch, ShoppingCartBatch):
+            with mock.patch.object(
+                    batch_class, 'existing', return_value=set()):
+                results = batch_class(self.user).add([first.pk, second.pk])
+            self.assertEqual(
+                {item['id']: item['status'] for item in results},
+                {first.pk: '400', second.pk: '201'})
+        self.assertEqual(Recipe.objects.get(pk=first.pk).favorites_count, 1)
+        self.assertEqual(Recipe.objects.get(pk=second.pk).favorites_count, 1)
+        self.assertEqual(stored_totals(self.user), actual_totals(self.user))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CartTotalsTests(TestCase):
+    """Итоги списка покупок совпадают с пересчётом по корзинам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('baker')
+        cls.buyers = [create_user('buyer'), create_user('shopper')]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Мука {number}', measurement_unit='г')
+            for number in range(4)
+        ]
+        cls.tag = Tag.objects.create(
+            name='Ужин', color='#000000', slug='dinner')
+        cls.recipes = []
+        for number in range(2):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Пирог {number}', image='a.png',
+                text='Описание', cooking_time=10,
+            )
+            IngredientForRecipe.objects.bulk_create([
+                IngredientForRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=100)
+                for ingredient in cls.ingredients[number:number + 3]
+            ])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        clear_caches()
+
+    def assert_totals_match(self):
+        for user in self.buyers:
+            self.assertEqual(stored_totals(user), actual_totals(user))
+
+    def fill_carts(self):
+        for user in self.buyers:
+            for recipe in self.recipes:
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+
+    def test_add_and_remove(self):
+        client = client_for(self.buyers[0])
+        for recipe in self.recipes:
+            url = f'/api/recipes/{recipe.pk}/shopping_cart/'
+            self.assertEqual(client.get(url).status_code, 201)
+            self.assert_totals_match()
+        self.assertEqual(
+            stored_totals(self.buyers[0])[self.ingredients[1].pk], 200)
+        client.delete(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        self.assert_totals_match()
+        client.delete(f'/api/recipes/{self.recipes[1].pk}/shopping_cart/')
+        self.assertEqual(stored_totals(self.buyers[0]), {})
+
+    def test_edit_carted_recipe_ingredients(self):
+        self.fill_carts()
+        recipe = self.recipes[0]
+        # Ингредиент 0 удалён, 1 изменён, 2 без изменений, 3 добавлен.
+        response = client_for(self.author).patch(
+            f'/api/recipes/{recipe.pk}/', {
+                'tags': [self.tag.pk],
+                'ingredients': [
+                    {'id': self.ingredients[1].pk, 'amount': 30},
+                    {'id': self.ingredients[2].pk, 'amount': 100},
+                    {'id': self.ingredients[3].pk, 'amount': 5},
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_totals_match()
+        self.assertNotIn(
+            self.ingredients[0].pk, stored_totals(self.buyers[1]))
+
+    def test_repeated_ingredient_amounts_are_summed(self):
+        recipe = self.recipes[0]
+        ingredient = self.ingredients[1].pk
+
+        def patch(*amounts):
+            return client_for(self.author).patch(
+                f'/api/recipes/{recipe.pk}/', {
+                    'tags': [self.tag.pk],
+                    'ingredients': [
+                        {'id': ingredient, 'amount': amount}
+                        for amount in amounts
+                    ],
+                }, format='json')
+
+        self.assertEqual(patch(10, 5).status_code, 200)
+        self.assertEqual(
+            list(recipe.ingredientforrecipe_set.values_list(
+                'ingredient', 'amount')),
+            [(ingredient, 15)])
+        response = patch(20000, 20000)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.json())
+        self.assertEqual(
+            recipe.ingredientforrecipe_set.get().amount, 15)
+
+    def test_delete_carted_recipe(self):
+        self.fill_carts()
+        response = client_for(self.author).delete(
+            f'/api/recipes/{self.recipes[1].pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_totals_match()
+        self.assertEqual(stored_totals(self.buyers[0]), {
+            ingredient.pk: 100 for ingredient in self.ingredients[:3]})
+
+    def test_delete_author_cascades(self):
+        self.fill_carts()
+        self.author.delete()
+        self.assert_totals_match()
+        self.assertEqual(stored_totals(self.buyers[0]), {})
+
+    def test_batch_add(self):
+        ShoppingCart.objects.create(
+            user=self.buyers[0], recipe=self.recipes[0])
+        response = client_for(self.buyers[0]).post(
+            '/api/recipes/shopping_cart/',
+            {'ids': [recipe.pk for recipe in self.recipes]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_totals_match()
+
+
+@override_settings(CACHES=TEST_CACHES, SIMILAR_INDEX_PATH='')
+class DeletedRecipeTests(TestCase):
+    """Рецепт, удалённый во внешней транзакции, пропадает из индексов."""
+
+    def setUp(self):
+        clear_caches()
+        similar_recipes.reset()
+        pantry_index.reset()
+        author = create_user('cook')
+        self.ingredients = [
+            Ingredient.objects.create(
+                name=f'Овощ {number}', measurement_unit='г')
+            for number in range(2)
+        ]
+        self.recipes = []
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Салат {number}', image='a.png',
+                text='Описание', cooking_time=10,
+            )
+            IngredientForRecipe.objects.bulk_create([
+                IngredientForRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=1)
+                for ingredient in self.ingredients
+            ])
+            self.recipes.append(recipe.pk)
+
+    def delete_in_atomic(self, pk):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Recipe.objects.get(pk=pk).delete()
+
+    def test_deleted_recipe_leaves_similar(self):
+        first, second, third = self.recipes
+        self.assertEqual(
+            {id_ for id_, _ in similar_recipes.top_k(first, 5)},
+            {second, third})
+        self.delete_in_atomic(second)
+        self.assertEqual(
+            [id_ for id_, _ in similar_recipes.top_k(first, 5)], [third])
+
+    def test_deleted_recipe_leaves_pantry(self):
+        first, second, third = self.recipes
+        pantry = [ingredient.pk for ingredient in self.ingredients]
+        self.assertEqual(
+            [id_ for id_, _, _ in pantry_index.match(pantry, 10)],
+            [third, second, first])
+        self.delete_in_atomic(second)
+        self.assertEqual(
+            [id_ for id_, _, _ in pantry_index.match(pantry, 10)],
+            [third, first])
+        self.assertEqual(
+            pantry_index.containing(pantry), {first, third})
+
+
+@override_settings(CACHES=TEST_CACHES, SIMILAR_INDEX_PATH='')
+class SeedBenchTests(TestCase):
+    """Строки seed_bench, созданные без сигналов, видны фильтру тегов и
+    индексам, построенным до заполнения."""
+
+    def setUp(self):
+        clear_caches()
+        similar_recipes.reset()
+        pantry_index.reset()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def test_seeded_rows_are_visible(self):
+        salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        recipe = Recipe.objects.create(
+            author=create_user('cook'), name='Рецепт', image='a.png',
+            text='Описание', cooking_time=10,
+        )
+        IngredientForRecipe.objects.create(
+            recipe=recipe, ingredient=salt, amount=1)
+        self.assertEqual(tag_choices(), [])
+        self.assertEqual(similar_recipes.top_k(recipe.pk, 5), [])
+        self.assertEqual(len(pantry_index.match([salt.pk], 10)), 1)
+
+        call_command(
+            'seed_bench', users=3, recipes=4, ingredients_per_recipe=1,
+            favorites_per_user=1, cart_per_user=1, follows_per_user=1,
+            seed=1, stdout=io.StringIO(),
+        )
+        seeded = set(Recipe.objects.exclude(
+            pk=recipe.pk).values_list('pk', flat=True))
+        self.assertIn(('breakfast', 'breakfast'), tag_choices())
+        response = APIClient().get('/api/recipes/', {'tags': 'breakfast'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {id_ for id_, _, _ in pantry_index.match([salt.pk], 10)},
+            seeded | {recipe.pk})
+        self.assertEqual(
+            {id_ for id_, _ in similar_recipes.top_k(recipe.pk, 5)}, seeded)
+
+    def test_explain_queries_reports_timings(self):
+        call_command(
+            'seed_bench', users=3, recipes=4, ingredients_per_recipe=1,
+            favorites_per_user=1, cart_per_user=1, follows_per_user=1,
+            seed=1, stdout=io.StringIO(),
+        )
+        output = io.StringIO()
+        call_command('explain_queries', repeat=2, stdout=output)
+        self.assertEqual(output.getvalue().count('медиана'), 5)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RemoveDuplicatesTests(TransactionTestCase):
+    """После remove_duplicates уникальные ограничения добавляются в базу
+    с дублями, а количества ингредиентов рецепта сохраняются."""
+
+    constrained = ((ShoppingCart, 0), (IngredientForRecipe, 0))
+
+    def setUp(self):
+        clear_caches()
+        for model, index in self.constrained:
+            constraint = model._meta.constraints[index]
+            # SQLite пересоздаёт таблицу по _meta, а не удаляет ограничение.
+            with mock.patch.object(model._meta, 'constraints', []):
+                with connection.schema_editor() as editor:
+                    editor.remove_constraint(model, constraint)
+        self.addCleanup(self.restore_constraints)
+        self.constraints_added = False
+
+    def add_constraints(self):
+        for model, index in self.constrained:
+            with connection.schema_editor() as editor:
+                editor.add_constraint(model, model._meta.constraints[index])
+        self.constraints_added = True
+
+    def restore_constraints(self):
+        if not self.constraints_added:
+            for model, _ in self.constrained:
+                model.objects.all().delete()
+            self.add_constraints()
+
+    def test_duplicates_are_merged_before_constraints(self):
+        user = create_user('buyer')
+        salt, sugar = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Соль', 'Сахар')
+        ]
+        recipe = Recipe.objects.create(
+            author=create_user('cook'), name='Рецепт', image='a.png',
+            text='Описание', cooking_time=10,
+        )
+        IngredientForRecipe.objects.bulk_create([
+            IngredientForRecipe(recipe=recipe, ingredient=salt, amount=2),
+            IngredientForRecipe(recipe=recipe, ingredient=salt, amount=3),
+            IngredientForRecipe(recipe=recipe, ingredient=sugar, amount=30000),
+            IngredientForRecipe(recipe=recipe, ingredient=sugar, amount=30000),
+        ])
+        ShoppingCart.objects.bulk_create(
+            [ShoppingCart(user=user, recipe=recipe)] * 2)
+
+        output = io.StringIO()
+        call_command('remove_duplicates', check=True, stdout=output)
+        self.assertIn('recipes.ShoppingCart: дублей 1', output.getvalue())
+        self.assertEqual(ShoppingCart.objects.count(), 2)
+
+        call_command('remove_duplicates', stdout=io.StringIO())
+        self.add_constraints()
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        self.assertEqual(
+            dict(IngredientForRecipe.objects.values_list(
+                'ingredient', 'amount')),
+            {salt.pk: 5, sugar.pk: 32767})
+
+
+class HumanizeAmountTests(SimpleTestCase):
+
+    def test_units_share_base_unit_per_dimension(self):
+        self.assertEqual(UNITS['кг'], ('mass', UNITS['г'][1] * 1000))
+        self.assertEqual(UNITS['л'], ('volume', UNITS['мл'][1] * 1000))
+
+    def test_large_amounts_use_larger_unit(self):
+        cases = [
+            ((1500, 'г'), (1.5, 'кг')),
+            ((1000, 'г'), (1, 'кг')),
+            ((999, 'г'), (999, 'г')),
+            ((1250, 'мл'), (1.25, 'л')),
+            ((3, 'кг'), (3, 'кг')),
+            ((2, 'л'), (2, 'л')),
+        ]
+        for (amount, unit), expected in cases:
+            with self.subTest(amount=amount, unit=unit):
+                self.assertEqual(humanize_amount(amount, unit), expected)
+
+    def test_other_units_are_kept(self):
+        for unit in ('ст. л.', 'ч. л.', 'стакан', 'шт.', 'по вкусу', ''):
+            with self.subTest(unit=unit):
+                self.assertEqual(humanize_amount(1500, unit), (1500, unit))
+
+    def test_rows_keep_their_own_unit(self):
+        rows = normalize_amounts([
+            {'ingredient__name': 'Мука', 'total_amount': 2500,
+             'ingredient__measurement_unit': 'г '},
+            {'ingredient__name': 'Яйца', 'total_amount': 3,
+             'ingredient__measurement_unit': 'шт.'},
+        ])
+        self.assertEqual(list(rows), [
+            {'name': 'Мука', 'amount': 2.5, 'measurement_unit': 'кг'},
+            {'name': 'Яйца', 'amount': 3, 'measurement_unit': 'шт.'},
+        ])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AsgiParityTests(TestCase):
+    """Анонимные чтения под ASGI отвечают так же, как под WSGI."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('asgi')
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#ff0000', slug='breakfast')
+        ingredient = Ingredient.objects.create(
+            name='Рис', measurement_unit='г')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Каша', image='a.png',
+            text='Описание', cooking_time=10,
+        )
+        cls.recipe.tags.set([cls.tag])
+        IngredientForRecipe.objects.create(
+            recipe=cls.recipe, ingredient=ingredient, amount=100)
+
+    async def assert_same(self, path, status_code):
+        clear_caches()
+        sync_response = await sync_to_async(self.client.get)(path)
+        clear_caches()
+        async_response = await AsyncClient().get(path)
+        self.assertEqual(sync_response.status_code, status_code)
+        self.assertEqual(async_response.status_code, status_code)
+        self.assertEqual(async_response.content, sync_response.content)
+        self.assertEqual(
+            async_response['Content-Type'], sync_response['Content-Type'])
+
+    async def test_responses_match(self):
+        cases = [
+            ('/api/recipes/', 200),
+            (f'/api/recipes/{self.recipe.pk}/', 200),
+            (f'/api/recipes/?tags=breakfast&author={self.author.pk}', 200),
+            ('/api/recipes/999999/', 404),
+            ('/api/recipes/?page=5', 404),
+            ('/api/recipes/?tags=brunch', 400),
+            ('/api/tags/', 200),
+            ('/api/ingredients/?name=Р', 200),
+        ]
+        for path, status_code in cases:
+            with self.subTest(path=path):
+                await self.assert_same(path, status_code)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class FeedTests(TestCase):
+    url = '/api/recipes/feed/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.authors = [create_user(f'author{number}') for number in range(4)]
+        cls.stranger = create_user('stranger')
+        for author in cls.authors[:3]:
+            Follow.objects.create(user=cls.reader, author=author)
+        cls.recipes = []
+        for number in range(12):
+            cls.recipes.append(Recipe.objects.create(
+                author=cls.authors[number % 4], name=f'Рецепт {number}',
+                image='a.png', text='Описание', cooking_time=10,
+            ).pk)
+        # По четыре рецепта с одинаковой датой публикации.
+        moment = Recipe.objects.get(pk=cls.recipes[0]).pub_date
+        for number, pk in enumerate(cls.recipes):
+            Recipe.objects.filter(pk=pk).update(
+                pub_date=moment - timedelta(minutes=10 - number // 4))
+        cls.following = {author.pk for author in cls.authors[:3]}
+
+    def setUp(self):
+        clear_caches()
+        self.client = client_for(self.reader)
+
+    def expected(self, authors):
+        return list(Recipe.objects.filter(author__in=authors).order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+
+    def walk(self, limit):
+        ids = []
+        url = f'{self.url}?limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.json()['results'])
+            url = response.json()['next']
+        return ids
+
+    def first_page(self):
+        return [
+            recipe['id']
+            for recipe in self.client.get(
+                self.url, {'limit': 20}).json()['results']
+        ]
+
+    def test_tied_dates_keep_order_across_pages(self):
+        expected = self.expected(self.following)
+        self.assertEqual(len(expected), 9)
+        for limit in (1, 2, 4, 5, 9, 10):
+            self.assertEqual(self.walk(limit), expected, limit)
+
+    def test_merge_matches_single_query(self):
+        positions = [None] + list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('pub_date', 'id'))
+        for position in positions:
+            for size in (1, 3, 10):
+                single = feed_positions(
+                    self.reader, self.following, position, size)
+                with self.settings(
+                        FEED_MERGE_THRESHOLD=0, FEED_MERGE_CHUNK_SIZE=1):
+                    merged = feed_positions(
+                        self.reader, self.following, position, size)
+                self.assertEqual(merged, single, (position, size))
+        with self.settings(FEED_MERGE_THRESHOLD=0, FEED_MERGE_CHUNK_SIZE=2):
+            self.assertEqual(self.walk(2), self.expected(self.following))
+
+    def test_first_page_follows_subscriptions_and_publications(self):
+        stranger = self.authors[3]
+        self.assertEqual(self.first_page(), self.expected(self.following))
+        self.assertIsNotNone(cache.get(feed_key(self.reader.pk)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(f'/api/users/{stranger.pk}/subscribe/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.first_page(), self.expected(self.following | {stranger.pk}))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/users/{stranger.pk}/subscribe/')
+        self.assertEqual(self.first_page(), self.expected(self.following))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new = Recipe.objects.create(
+                author=self.authors[0], name='Новый', image='a.png',
+                text='Описание', cooking_time=10,
+            )
+        self.assertEqual(self.first_page()[0], new.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                author=self.stranger, name='Чужой', image='a.png',
+                text='Описание', cooking_time=10,
+            )
+        self.assertEqual(self.first_page(), self.expected(self.following))
+
+
+@override_settings(
+    CACHES=TEST_CACHES, METRICS_ENABLED=True, METRICS_TOKEN='scrape-token')
+class MetricsTests(TestCase):
+    url = '/api/_metrics'
+
+    def status_for(self, authorization=None):
+        headers = {}
+        if authorization is not None:
+            headers['HTTP_AUTHORIZATION'] = authorization
+        return self.client.get(self.url, **headers).status_code
+
+    def test_metrics_require_token_or_staff(self):
+        self.assertEqual(self.status_for(), 403)
+        self.assertEqual(self.status_for('Bearer wrong'), 403)
+        self.assertEqual(self.status_for('Bearer scrape-token'), 200)
+        user = create_user('viewer')
+        self.client.force_login(user)
+        self.assertEqual(self.status_for(), 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.status_for(), 200)
+        self.client.logout()
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.status_for('Bearer '), 403)
+
+    async def test_asgi_queries_are_counted(self):
+        clear_caches()
+        response = await AsyncClient().get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(
+            response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IngredientAutocompleteTests(TestCase):
+    url = '/api/ingredients/'
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in (
+            'Молоко', 'Молоко топлёное', 'Кокосовое молоко', 'Мука',
+            'Сгущённое молоко', 'Соль', 'Мак и маковый сироп',
+        ):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        clear_caches()
+        ingredient_index.reset()
+
+    def names(self, query):
+        response = APIClient().get(self.url, {'name': query})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_prefix_matches_come_before_substring_matches(self):
+        expected = [
+            'Молоко', 'Молоко топлёное',
+            'Кокосовое молоко', 'Сгущённое молоко',
+        ]
+        self.assertEqual(self.names('мол'), expected)
+        self.assertEqual(self.names('МОЛОКО'), expected)
+        self.assertEqual(self.names('ёное'), ['Молоко топлёное'])
+        self.assertEqual(self.names('зефир'), [])
+
+    def test_each_ingredient_is_listed_once(self):
+        self.assertEqual(self.names('мак'), ['Мак и маковый сироп'])
+        # Вхождения упорядочены по тексту от вхождения: «ко» в конце
+        # названия раньше «ко топлёное» и «ковый».
+        self.assertEqual(self.names('ко'), [
+            'Кокосовое молоко', 'Молоко', 'Сгущённое молоко',
+            'Молоко топлёное', 'Мак и маковый сироп',
+        ])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=3)
+    def test_results_are_limited(self):
+        self.assertEqual(
+            self.names('моло'),
+            ['Молоко', 'Молоко топлёное', 'Кокосовое молоко'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RelationFlagsTests(TestCase):
+    """Запись избранного, корзины и подписок видна в следующем ответе,
+    хотя связи пользователя закэшированы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('writer')
+        cls.admin = CustomUser.objects.create_superuser(
+            email='root@example.com', username='root',
+            first_name='root', last_name='root', password='pass-word-123',
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', image='a.png',
+            text='Описание', cooking_time=10,
+        )
+
+    def setUp(self):
+        clear_caches()
+        self.client = client_for(self.user)
+        self.admin_client = self.client_class()
+        self.admin_client.force_login(self.admin)
+
+    def flags(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return (
+            data['is_favorited'],
+            data['is_in_shopping_cart'],
+            data['author']['is_subscribed'],
+        )
+
+    def assert_flips(self, write, expected):
+        self.flags()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = write()
+        self.assertLess(response.status_code, 400)
+        self.assertEqual(self.flags(), expected)
+
+    def test_single_endpoints(self):
+        recipe_id, author_id = self.recipe.pk, self.author.pk
+        steps = [
+            (f'/api/recipes/{recipe_id}/favorite/', (True, False, False)),
+            (f'/api/recipes/{recipe_id}/shopping_cart/', (True, True, False)),
+            (f'/api/users/{author_id}/subscribe/', (True, True, True)),
+        ]
+        for url, expected in steps:
+            with self.subTest(url=url, method='get'):
+                self.assert_flips(lambda: self.client.get(url), expected)
+        cleared = [(False, True, True), (False, False, True),
+                   (False, False, False)]
+        for (url, _), expected in zip(steps, cleared):
+            with self.subTest(url=url, method='delete'):
+                self.assert_flips(lambda: self.client.delete(url), expected)
+
+    def test_batch_endpoints(self):
+        steps = [
+            ('/api/recipes/favorite/', self.recipe.pk, (True, False, False)),
+            ('/api/recipes/shopping_cart/', self.recipe.pk,
+             (True, True, False)),
+            ('/api/users/subscribe/', self.author.pk, (True, True, True)),
+        ]
+        for url, id_, expected in steps:
+            with self.subTest(url=url, method='post'):
+                self.assert_flips(lambda: self.client.post(
+                    url, {'ids': [id_]}, format='json'), expected)
+        cleared = [(False, True, True), (False, False, True),
+                   (False, False, False)]
+        for (url, id_, _), expected in zip(steps, cleared):
+            with self.subTest(url=url, method='delete'):
+                self.assert_flips(lambda: self.client.delete(
+                    url, {'ids': [id_]}, format='json'), expected)
+
+    def test_admin(self):
+        user_id = self.user.pk
+        steps = [
+            ('recipes/favorite', Favorite,
+             {'user': user_id, 'recipe': self.recipe.pk},
+             (True, False, False)),
+            ('recipes/shoppingcart', ShoppingCart,
+             {'user': user_id, 'recipe': self.recipe.pk},
+             (True, True, False)),
+            ('users/follow', Follow,
+             {'user': user_id, 'author': self.author.pk},
+             (True, True, True)),
+        ]
+        for path, _, data, expected in steps:
+            with self.subTest(path=path, action='add'):
+                self.assert_flips(lambda: self.admin_client.post(
+                    f'/admin/{path}/add/', data), expected)
+        cleared = [(False, True, True), (False, False, True),
+                   (False, False, False)]
+        for (path, model, _, _), expected in zip(steps, cleared):
+            with self.subTest(path=path, action='delete'):
+                pk = model.objects.get(user=self.user).pk
+                self.assert_flips(lambda: self.admin_client.post(
+                    f'/admin/{path}/{pk}/delete/', {'post': 'yes'}),
+                    expected)
@@ -2,8 +2,9 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from users.views import FollowViewSet
 
-from .views import (DownloadShoppingCart, FavouriteViewSet, IngredientViewSet,
-                    RecipesViewSet, ShoppingListViewSet, TagsViewSet)
+from .views import (DownloadShoppingCart, FavouriteBatchViewSet,
+                    FavouriteViewSet, IngredientViewSet, RecipesViewSet,
+                    ShoppingListBatchViewSet, ShoppingListViewSet, TagsViewSet)
 
 router = DefaultRouter()
 router.register('tags', TagsViewSet, basename='tags')
@@ -12,6 +13,10 @@ router.register('ingredients', IngredientViewSet, basename='ingredients')
 router.register('users', FollowViewSet, basename='users')
 
 urlpatterns = [
+    path('recipes/favorite/',
+         FavouriteBatchViewSet.as_view(), name='batch_favorite'),
+    path('recipes/shopping_cart/',
+         ShoppingListBatchViewSet.as_view(), name='batch_shopping_cart'),
     path('recipes/<int:recipe_id>/favorite/',
          FavouriteViewSet.as_view(), name='add_recipe_to_favorite'),
     path('recipes/<int:recipe_id>/shopping_cart/',
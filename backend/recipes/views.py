@@ -1,27 +1,43 @@
-from django.http.response import HttpResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.http.response import (HttpResponse, HttpResponseNotModified,
+                                  StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
+from .batch import FavoriteBatch, ShoppingCartBatch, batch_response
+from .cache import CachedResponseMixin
+from .feed import decode_cursor, encode_cursor, feed_page
 from .filters import IngredientFilter, RecipeFilter
-from .models import (Favorite, Ingredient, IngredientForRecipe, Recipe,
-                     ShoppingCart, Tag)
-from .paginators import PageNumberPaginatorModified
+from .models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from .page_cache import PageCacheMixin
+from .paginators import (PageNumberPaginatorModified, RecipeCursorPaginator,
+                         is_cursor_requested)
+from .pantry import pantry_index
 from .permissions import AdminOrAuthorOrReadOnly
-from .serializers import IngredientSerializer, RecipeSerializer, TagSerializer
+from .relations import get_relations
+from .serializers import (IngredientSerializer, RecipeSerializer,
+                          ShortRecipeSerializer, TagSerializer)
+from .shopping_list import (EXPORT_FORMATS, cached_stream, shopping_list_key,
+                            shopping_list_rows)
+from .similar import similar_recipes
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+class TagsViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     permission_classes = (AllowAny,)
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
     permission_classes = (AllowAny,)
@@ -30,14 +46,105 @@ class IngredientViewSet(viewsets.ModelViewSet):
     pagination_class = None
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(PageCacheMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     filter_backends = [DjangoFilterBackend, ]
-    filter_class = RecipeFilter
+    filterset_class = RecipeFilter
     permission_classes = (AdminOrAuthorOrReadOnly,)
     pagination_class = PageNumberPaginatorModified
     serializer_class = RecipeSerializer
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if is_cursor_requested(self.request):
+                self._paginator = RecipeCursorPaginator()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        return Recipe.objects.with_related()
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        try:
+            position = decode_cursor(request.query_params.get('cursor'))
+        except ValueError:
+            return Response({
+                'message': 'Неверный курсор',
+                'status': f'{status.HTTP_400_BAD_REQUEST}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(
+            self.paginator.get_page_size(request),
+            settings.FEED_MAX_PAGE_SIZE,
+        )
+        page = feed_page(
+            request.user, get_relations(request).following,
+            position, limit + 1,
+        )
+        recipes = Recipe.objects.with_related().in_bulk(
+            [pk for _, pk in page[:limit]])
+        serializer = self.get_serializer(
+            [recipes[pk] for _, pk in page[:limit] if pk in recipes],
+            many=True,
+        )
+        next_link = None
+        if len(page) > limit:
+            next_link = replace_query_param(
+                request.build_absolute_uri(), 'cursor',
+                encode_cursor(page[limit - 1]))
+        return Response({'next': next_link, 'results': serializer.data})
+
+    @action(detail=False, permission_classes=(AllowAny,))
+    def pantry(self, request):
+        ingredients = request.query_params.get('ingredients', '').split(',')
+        max_missing = request.query_params.get('max_missing')
+        if (not all(id_.isdigit() for id_ in ingredients)
+                or len(ingredients) > settings.PANTRY_MAX_INGREDIENTS
+                or not (max_missing is None or max_missing.isdigit())):
+            return Response({
+                'message': 'Укажите id ингредиентов через запятую, '
+                           f'не больше {settings.PANTRY_MAX_INGREDIENTS}',
+                'status': f'{status.HTTP_400_BAD_REQUEST}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        matches = pantry_index.match(
+            [int(id_) for id_ in ingredients],
+            settings.PANTRY_RESULTS_LIMIT,
+            None if max_missing is None else int(max_missing),
+        )
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(matches, request, view=self)
+        recipes = Recipe.objects.in_bulk([id_ for id_, _, _ in page])
+        return paginator.get_paginated_response([
+            {
+                **ShortRecipeSerializer(
+                    recipes[id_], context={'request': request}).data,
+                'coverage': coverage,
+                'missing': missing,
+            }
+            for id_, coverage, missing in page if id_ in recipes
+        ])
+
+    @action(detail=True, permission_classes=(AllowAny,))
+    def similar(self, request, pk=None):
+        recipe = get_object_or_404(Recipe, pk=pk)
+        limit = request.query_params.get('limit', '')
+        limit = min(
+            int(limit) if limit.isdigit() else settings.SIMILAR_RECIPES_LIMIT,
+            settings.SIMILAR_MAX_LIMIT,
+        )
+        neighbours = similar_recipes.top_k(recipe.pk, limit)
+        recipes = Recipe.objects.in_bulk([id_ for id_, _ in neighbours])
+        return Response([
+            {
+                **ShortRecipeSerializer(
+                    recipes[id_], context={'request': request}).data,
+                'similarity': score,
+            }
+            for id_, score in neighbours if id_ in recipes
+        ])
+
 
 class FavouriteViewSet(APIView):
     permission_classes = (IsAuthenticated, )
@@ -75,6 +182,16 @@ class FavouriteViewSet(APIView):
         })
 
 
+class FavouriteBatchViewSet(APIView):
+    permission_classes = (IsAuthenticated, )
+
+    def post(self, request):
+        return batch_response(request, FavoriteBatch)
+
+    def delete(self, request):
+        return batch_response(request, FavoriteBatch)
+
+
 class ShoppingListViewSet(APIView):
     permission_classes = (IsAuthenticated, )
 
@@ -109,35 +226,49 @@ class ShoppingListViewSet(APIView):
         })
 
 
+class ShoppingListBatchViewSet(APIView):
+    permission_classes = (IsAuthenticated, )
+
+    def post(self, request):
+        return batch_response(request, ShoppingCartBatch)
+
+    def delete(self, request):
+        return batch_response(request, ShoppingCartBatch)
+
+
 class DownloadShoppingCart(APIView):
     permission_classes = (IsAuthenticated, )
 
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= выбирает формат файла, а не рендерер DRF.
+        return super().perform_content_negotiation(request, force=True)
+
     def get(self, request):
-        user = request.user
-        shopping_cart = user.purchases.all()
-        buying_list = {}
-        for record in shopping_cart:
-            recipe = record.recipe
-            ingredients = IngredientForRecipe.objects.filter(recipe=recipe)
-            for ingredient in ingredients:
-                amount = ingredient.amount
-                name = ingredient.ingredient.name
-                measurement_unit = ingredient.ingredient.measurement_unit
-                if name not in buying_list:
-                    buying_list[name] = {
-                        'measurement_unit': measurement_unit,
-                        'amount': amount
-                    }
-                else:
-                    buying_list[name]['amount'] = (buying_list[name]['amount']
-                                                   + amount)
-
-        wishlist = []
-        for item in buying_list:
-            wishlist.append(f'{item} - {buying_list[item]["amount"]} '
-                            f'{buying_list[item]["measurement_unit"]} \n')
-        wishlist.append('\n')
-        wishlist.append('FoodGram, 2021')
-        response = HttpResponse(wishlist, 'Content-Type: text/plain')
-        response['Content-Disposition'] = 'attachment; filename="wishlist.txt"'
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in EXPORT_FORMATS:
+            return Response({
+                'message': 'Доступные форматы: '
+                           f'{", ".join(EXPORT_FORMATS)}',
+                'status': f'{status.HTTP_400_BAD_REQUEST}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type, render = EXPORT_FORMATS[export_format]
+        key = shopping_list_key(
+            export_format, get_relations(request).shopping_cart)
+        etag = f'"{export_format}-{key.rsplit(":", 1)[-1]}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        content = cache.get(key)
+        if content is not None:
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(
+                cached_stream(key, render(shopping_list_rows(request.user))),
+                content_type=content_type)
+        response['ETag'] = etag
+        response['Content-Disposition'] = (
+            f'attachment; filename="wishlist.{export_format}"')
         return response
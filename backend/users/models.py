@@ -23,6 +23,12 @@ class CustomUser(AbstractUser):
         unique=True,
         max_length=254
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов', default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков', default=0, editable=False
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
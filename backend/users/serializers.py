@@ -1,4 +1,5 @@
 from djoser.serializers import UserCreateSerializer
+from recipes.relations import get_relations
 from rest_framework import serializers
 
 from .models import CustomUser, Follow
@@ -22,10 +23,8 @@ class UserSerializer(serializers.ModelSerializer):
                   'first_name', 'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
-            return False
-        return Follow.objects.filter(user=request.user, author=obj).exists()
+        relations = get_relations(self.context.get('request'))
+        return obj.pk in relations.following
 
 
 class FollowSerializer(serializers.ModelSerializer):
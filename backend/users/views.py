@@ -1,5 +1,9 @@
-
-from recipes.paginators import PageNumberPagination
+from django.db.models import OuterRef, Prefetch
+from recipes.batch import FollowBatch, batch_response
+from recipes.models import Recipe
+from recipes.paginators import (PageNumberPagination,
+                                SubscriptionCursorPaginator,
+                                is_cursor_requested)
 from recipes.serializers import UserSerializer
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
@@ -15,11 +19,27 @@ class FollowViewSet(viewsets.GenericViewSet):
 
     @action(detail=False)
     def subscriptions(self, request):
-        user_qs = CustomUser.objects.filter(following__user=request.user)
-        paginator = PageNumberPagination()
-        paginator.page_size = 10
+        recipes = Recipe.objects.order_by('-pub_date')
+        recipes_limit = request.query_params.get('recipes_limit')
+        if recipes_limit is not None and recipes_limit.isdigit():
+            recipes = recipes.filter(pk__in=Recipe.objects.filter(
+                author=OuterRef('author')
+            ).order_by('-pub_date').values('pk')[:int(recipes_limit)])
+
+        user_qs = CustomUser.objects.filter(
+            following__user=request.user
+        ).prefetch_related(
+            'purchases',
+            Prefetch('recipes', queryset=recipes),
+        )
+        if is_cursor_requested(request):
+            paginator = SubscriptionCursorPaginator()
+        else:
+            paginator = PageNumberPagination()
+            paginator.page_size = 10
         result_page = paginator.paginate_queryset(user_qs, request)
-        serializer = UserSerializer(result_page, many=True)
+        serializer = UserSerializer(
+            result_page, many=True, context={'request': request})
         return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['GET', 'DELETE'])
@@ -47,3 +67,7 @@ class FollowViewSet(viewsets.GenericViewSet):
                 'status': f'{status.HTTP_204_NO_CONTENT}'
             })
         return Response(status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    @action(detail=False, methods=['POST', 'DELETE'], url_path='subscribe')
+    def subscribe_batch(self, request):
+        return batch_response(request, FollowBatch)